@@ -0,0 +1,137 @@
+import numpy as np
+from household import UTILITY_CUTOFF, CUTOFF_MARGIN
+
+
+class HouseholdArrays:
+    """
+    Struct-of-arrays copy of the city's households used by the array engine.
+
+    Every household attribute is stored in its own NumPy array indexed by the agent's
+    position in the schedule. The neighborhood adoption fraction of all agents is evaluated
+    in one pass from the model's per-cell rasters. The Household agents are kept in sync
+    whenever a value changes, so the model reporters keep working on `schedule.agents`.
+    """
+
+    def __init__(self, agents, rasters):
+        """
+        Build the arrays from already placed household agents.
+
+        Args:
+            agents (list): Household agents, in schedule order.
+            rasters (CellRasters): The model's per-cell household counts.
+        """
+        self.agents = list(agents)
+        self.income = np.array([a.income for a in self.agents], dtype=np.int8)
+        self.education_level = np.array([a.education_level for a in self.agents], dtype=np.int8)
+        self.type = np.array([a.type for a in self.agents], dtype=np.int8)
+        self.stubborness_factor = np.array([a.stubborness_factor for a in self.agents], dtype=float)
+        self.environmental_consciousness = np.array([a.environmental_consciousness for a in self.agents], dtype=float)
+        self.subsidy = np.array([a.subsidy for a in self.agents], dtype=np.int8)
+        self.solar_panels = np.array([a.solar_panels for a in self.agents], dtype=np.int8)
+        self.x = np.array([a.pos[0] for a in self.agents], dtype=np.intp)
+        self.y = np.array([a.pos[1] for a in self.agents], dtype=np.intp)
+        self.rasters = rasters
+
+        # Cached utility terms that do not depend on the neighbors or the noise
+        self._static_utility = None
+        self._static_key = None
+
+    @classmethod
+    def from_arrays(cls, income, education_level, type, stubborness_factor, environmental_consciousness, x, y, rasters):
+        """
+        Build the arrays of households that have no Household agents (e.g. one tile of a partitioned city).
+
+        Adoptions then update `rasters` directly instead of going through the agents and their model.
+        """
+        households = cls([], rasters)
+        households.agents = None
+        households.income = np.asarray(income, dtype=np.int8)
+        households.education_level = np.asarray(education_level, dtype=np.int8)
+        households.type = np.asarray(type, dtype=np.int8)
+        households.stubborness_factor = np.asarray(stubborness_factor, dtype=float)
+        households.environmental_consciousness = np.asarray(environmental_consciousness, dtype=float)
+        households.subsidy = np.zeros(len(households.income), dtype=np.int8)
+        households.solar_panels = np.zeros(len(households.income), dtype=np.int8)
+        households.x = np.asarray(x, dtype=np.intp)
+        households.y = np.asarray(y, dtype=np.intp)
+        return households
+
+    def fraction_with_solar(self):
+        """
+        Fraction of Moore neighbors with solar panels for every agent.
+
+        Apartments count everyone in their own cell (including themselves) as neighbors,
+        houses only count the surrounding cells, as in `Household.get_neighbours`.
+
+        Returns:
+            numpy.ndarray: Fraction of adopting neighbors per agent (0 if it has no neighbors).
+        """
+        neighbour_adopters, neighbours = self.rasters.neighbourhood_counts()
+        neighbour_adopters = neighbour_adopters[self.x, self.y]
+        neighbours = neighbours[self.x, self.y]
+        return np.divide(neighbour_adopters, neighbours, out=np.zeros(len(neighbours)), where=neighbours > 0)
+
+    def apply_subsidy(self, draws):
+        """
+        Assign subsidies: always for low income, with probability 0.4 for mid income, never for high income.
+
+        Args:
+            draws (numpy.ndarray): One uniform [0, 1) draw per agent.
+        """
+        mid_income_draws = draws < 0.4
+        self.subsidy = np.where(self.income == 1, 1, np.where(self.income == 2, mid_income_draws, 0)).astype(np.int8)
+        self._static_utility = None
+        if self.agents is not None:
+            for agent, subsidy in zip(self.agents, self.subsidy.tolist()):
+                agent.set_subsidy(subsidy)
+
+    def static_utility(self, citymodel, beta1, beta2, beta4, beta5, beta6, beta7):
+        """Utility terms of every agent that stay fixed between subsidy or beta changes, cached."""
+        key = (beta1, beta2, beta4, beta5, beta6, beta7, citymodel.subsidy)
+        if self._static_utility is None or key != self._static_key:
+            self._static_utility = (beta1 * (self.income / 3) + beta2 * self.environmental_consciousness
+                                    - beta4 * self.stubborness_factor + beta5 * (self.education_level / 3)
+                                    + beta6 * self.subsidy * citymodel.subsidy + beta7 * (1 - self.type))
+            self._static_key = key
+        return self._static_utility
+
+    def utility(self, citymodel, beta1, beta2, beta3, beta4, beta5, beta6, beta7, index, fraction_with_solar, noise):
+        """Calculate the utility of the agents at `index`, in the same order of operations as `Household.utility`."""
+        return (beta1 * (self.income[index] / 3) + beta2 * self.environmental_consciousness[index]
+                + beta3 * fraction_with_solar - beta4 * self.stubborness_factor[index]
+                + beta5 * (self.education_level[index] / 3) + beta6 * self.subsidy[index] * citymodel.subsidy
+                + beta7 * (1 - self.type[index]) + noise)
+
+    def step(self, citymodel, beta1, beta2, beta3, beta4, beta5, beta6, beta7, noise):
+        """
+        Apply the probit adoption rule to all agents without solar panels at once.
+
+        All agents decide on the adoption state at the start of the step, so adoptions in
+        this step only influence neighbors from the next step onwards.
+
+        Args:
+            noise (numpy.ndarray): This step's utility noise, one draw per agent.
+
+        Returns:
+            numpy.ndarray: Indices of the agents that adopted in this step.
+        """
+        pending = np.flatnonzero(self.solar_panels == 0)
+        fraction_with_solar = self.fraction_with_solar()[pending]
+        noise = noise[pending]
+
+        static = self.static_utility(citymodel, beta1, beta2, beta4, beta5, beta6, beta7)[pending]
+        utility = static + beta3 * fraction_with_solar + noise
+        close = np.flatnonzero(np.abs(utility - UTILITY_CUTOFF) < CUTOFF_MARGIN)
+        if len(close):
+            utility[close] = self.utility(citymodel, beta1, beta2, beta3, beta4, beta5, beta6, beta7,
+                                          pending[close], fraction_with_solar[close], noise[close])
+        adopted = pending[utility >= UTILITY_CUTOFF]
+
+        self.solar_panels[adopted] = 1
+        if self.agents is None:
+            np.add.at(self.rasters.adopters, (self.x[adopted], self.y[adopted]), 1)
+            return adopted
+        # The agents report their adoption to the model, which updates the rasters and neighbor counters
+        for i in adopted.tolist():
+            self.agents[i].set_solar_panels(1)
+        return adopted
@@ -0,0 +1,215 @@
+import argparse
+import datetime
+import gc
+import itertools
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+import warnings
+import numpy as np
+import matplotlib.pyplot as plt
+from city import CityModel
+from array_engine import HouseholdArrays
+from event_engine import EventEngine
+warnings.filterwarnings("ignore", category=RuntimeWarning)
+
+
+"""This script benchmarks the CityModel: it times initialization, stepping and every model reporter
+   across a matrix of city sizes, placement modes, engines and adoption levels, measures peak memory,
+   and writes the results to a JSON file so runs can be compared over time."""
+
+
+def parse_sizes(text):
+    """Parse a "width:num_agents,..." list of square city sizes."""
+    sizes = []
+    for item in text.split(","):
+        width, num_agents = item.split(":")
+        sizes.append((int(width), int(num_agents)))
+    return sizes
+
+
+def seed_adopters(model, fraction, rng):
+    """
+    Give solar panels to a random `fraction` of the households, as if the model had already run for a while.
+
+    Args:
+        model (CityModel): Freshly initialized model.
+        fraction (float): Share of households that adopt.
+        rng (numpy.random.Generator): Random stream choosing the adopters.
+    """
+    n = len(model.household_list)
+    for i in rng.choice(n, size=int(round(fraction * n)), replace=False).tolist():
+        model.household_list[i].set_solar_panels(1)
+    # The array and event engines copy the adoption state when they are built
+    if model.households is not None:
+        model.households = HouseholdArrays(model.household_list, model.rasters)
+    if model.events is not None:
+        model.events = EventEngine(model.households, model.neighbours, model.rng)
+
+
+def build_model(config, seed):
+    """Initialize a model for one benchmark configuration (metrics collection is timed separately)."""
+    width, num_agents, flag_random, engine, adoption = config
+    return CityModel(width=width, height=width, num_agents=num_agents, flag_random=flag_random, engine=engine,
+                     seed=seed, max_steps=10 ** 9, collect_every=None)
+
+
+def time_config(config, steps, repeats, seed):
+    """
+    Time initialization, stepping and the model reporters of one configuration.
+
+    Args:
+        config (tuple): (width, num_agents, flag_random, engine, adoption level).
+        steps (int): Number of steps timed per repeat.
+        repeats (int): Number of repeats; the fastest is reported, as it is the least disturbed by other load.
+        seed (int): Seed of the models.
+
+    Returns:
+        dict: Timings in seconds, agent-steps per second and peak memory in bytes.
+    """
+    adoption = config[-1]
+    init_times, step_times, reporter_times = [], [], {}
+    for repeat in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        model = build_model(config, seed + repeat)
+        init_times.append(time.perf_counter() - start)
+        seed_adopters(model, adoption, np.random.default_rng(seed + repeat))
+
+        for name, reporter in model.datacollector.model_reporters.items():
+            start = time.perf_counter()
+            reporter(model)
+            reporter_times.setdefault(name, []).append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in range(steps):
+            model.step()
+        step_times.append((time.perf_counter() - start) / steps)
+
+    # Peak memory in a separate run, as tracing allocations slows the model down
+    gc.collect()
+    tracemalloc.start()
+    model = build_model(config, seed)
+    init_size, init_peak = tracemalloc.get_traced_memory()
+    # Seeding the adopters is setup, not initialization: keep it out of both peaks. The stepping
+    # peak is traced from scratch and counted on top of the memory the initialized model holds
+    tracemalloc.stop()
+    seed_adopters(model, adoption, np.random.default_rng(seed))
+    gc.collect()
+    tracemalloc.start()
+    for _ in range(steps):
+        model.step()
+    peak = max(init_peak, init_size + tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+
+    num_agents = len(model.household_list)
+    return {
+        "init_s": min(init_times),
+        "step_s": min(step_times),
+        "agent_steps_per_s": num_agents / min(step_times),
+        "reporters_s": {name: min(times) for name, times in reporter_times.items()},
+        "init_peak_bytes": init_peak,
+        "peak_bytes": peak,
+        "adopters": model.total_solar,
+    }
+
+
+def run_benchmarks(sizes, flag_randoms, engines, adoptions, steps, repeats, seed):
+    """
+    Benchmark every combination of the given sizes, placement modes, engines and adoption levels.
+
+    Returns:
+        list: One result dict per configuration.
+    """
+    results = []
+    for (width, num_agents), flag_random, engine, adoption in itertools.product(sizes, flag_randoms, engines, adoptions):
+        config = (width, num_agents, flag_random, engine, adoption)
+        result = {"width": width, "height": width, "num_agents": num_agents, "flag_random": flag_random,
+                  "engine": engine, "adoption": adoption,
+                  **time_config(config, steps, repeats, seed)}
+        results.append(result)
+        print(f"{width}x{width} agents={num_agents} flag_random={flag_random} engine={engine} adoption={adoption}: "
+              f"init {result['init_s']:.3f}s, step {result['step_s'] * 1000:.2f}ms "
+              f"({result['agent_steps_per_s']:.3g} agent-steps/s), peak {result['peak_bytes'] / 2 ** 20:.1f} MiB")
+    return results
+
+
+def environment():
+    """Metadata identifying the machine and code version of a benchmark run."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+    }
+
+
+def compare(results, baseline_path):
+    """Print the step time and init time of every configuration relative to an earlier benchmark file."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    key = lambda r: (r["width"], r["num_agents"], r["flag_random"], r["engine"], r["adoption"])
+    earlier = {key(r): r for r in baseline}
+    for result in results:
+        old = earlier.get(key(result))
+        if old is None:
+            continue
+        print(f"{key(result)}: step x{result['step_s'] / old['step_s']:.2f}, init x{result['init_s'] / old['init_s']:.2f}")
+
+
+def plot_scaling(results, path):
+    """Plot step time against the number of agents for every engine, placement mode and adoption level."""
+    plt.figure(figsize=(8, 6))
+    groups = sorted({(r["engine"], r["flag_random"], r["adoption"]) for r in results})
+    for engine, flag_random, adoption in groups:
+        group = sorted((r for r in results if (r["engine"], r["flag_random"], r["adoption"]) == (engine, flag_random, adoption)),
+                       key=lambda r: r["num_agents"])
+        plt.loglog([r["num_agents"] for r in group], [r["step_s"] for r in group], marker="o",
+                   label=f"{engine}, flag_random={flag_random}, adoption={adoption}")
+    plt.xlabel("Number of agents")
+    plt.ylabel("Time per step (s)")
+    plt.title("CityModel step time scaling")
+    plt.legend(fontsize="small")
+    plt.savefig(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark initialization, stepping and metrics of the CityModel.")
+    parser.add_argument('--sizes', type=str, default="60:2500,120:10000,240:40000",
+                        help='Comma-separated width:num_agents pairs of the (square) cities to benchmark')
+    parser.add_argument('--flag_random', type=int, nargs='+', default=[0, 1], help='Placement modes to benchmark')
+    parser.add_argument('--engines', type=str, nargs='+', default=['agent', 'array', 'event'],
+                        choices=['agent', 'array', 'event'], help='Engines to benchmark')
+    parser.add_argument('--adoption', type=float, nargs='+', default=[0.0, 0.1, 0.5],
+                        help='Share of households given solar panels before timing steps and reporters')
+    parser.add_argument('--steps', type=int, default=20, help='Number of steps timed per repeat')
+    parser.add_argument('--repeats', type=int, default=3, help='Number of repeats per configuration (fastest is kept)')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the benchmarked models')
+    parser.add_argument('--output', type=str, default="csv/benchmark.json", help='JSON file the results are written to')
+    parser.add_argument('--compare', type=str, default=None, help='Earlier benchmark JSON file to compare against')
+    parser.add_argument('--plot', type=str, default=None, help='Save a scaling plot of the step time to this file')
+    args = parser.parse_args()
+
+    results = run_benchmarks(parse_sizes(args.sizes), args.flag_random, args.engines, args.adoption,
+                             args.steps, args.repeats, args.seed)
+    with open(args.output, "w") as f:
+        json.dump({"environment": environment(), "settings": vars(args), "results": results}, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare is not None:
+        compare(results, args.compare)
+    if args.plot is not None:
+        plot_scaling(results, args.plot)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,34 @@
+import json
+import os
 from mesa import Model
 from household import Household
 from grid import Grid
 from mesa.time import RandomActivation 
 from mesa.datacollection import DataCollector
-import random
-from emergence_analysis import compute_global_adoption, compute_clustering_score, compute_morans_I, gini_between_income_classes
+import numpy as np
+import pandas as pd
+from array_engine import HouseholdArrays
+from event_engine import EventEngine
+from raster import CellRasters
+from population import Population, build_population
+from metrics_sink import read_metrics
+from profiling import NULL_TIMER, PhaseTimer
+from rng import as_seed_sequence, child_seed, numpy_generator, python_random, PLACEMENT_STREAM, DYNAMICS_STREAM
+from emergence_analysis import AdoptionMoran, adoption_count_reporters, compute_global_adoption, compute_clustering_score, compute_morans_I, gini_between_income_classes
 
-#random.seed(42)  # For reproducibility
 
 class CityModel(Model):
     """ A city simulation model using the Mesa framework to represent households' decisions to adopt solar panels
     based on income, education, environmental consciousness, government subsidies, and social dynamics. """
 
+    def __new__(cls, *args, **kwargs):
+        # Mesa's Model.__new__ seeds random.Random with the raw seed, which rejects SeedSequence seeds;
+        # __init__ derives all random streams from the seed instead
+        return object.__new__(cls)
+
     def __init__(self, width=120, height=120, num_agents=10000, subsidy=1, subsidy_timestep=0, max_steps=200, beta1 = 0.35,
-        beta2 = 0.05, beta3 = 0.5, beta4 = 0.2, beta5 = 0.3, beta6 = 0.3, beta7 = 0.6, flag_random=0):
+        beta2 = 0.05, beta3 = 0.5, beta4 = 0.2, beta5 = 0.3, beta6 = 0.3, beta7 = 0.6, flag_random=0, engine="agent", seed=None,
+        collect_every=1, reporters=None, population=None, metrics_sink=None, profile=False):
         """
         Initialize the CityModel.
 
@@ -25,15 +40,49 @@ class CityModel(Model):
             subsidy_timestep (int): Timestep at which subsidy begins.
             max_steps (int): Maximum number of simulation steps.
             beta1-7 (float): Parameters controlling behavioral/social influence effects.
+            flag_random (int): Whether agents are placed randomly (1) or in the 11 neighborhoods (0).
+            engine (str): "agent" to step every Household object in turn, "array" to evaluate
+                all households at once on NumPy arrays (see `HouseholdArrays`), "event" to sample
+                the adoption times and only process the steps in which someone adopts (see `EventEngine`).
+            seed (None | int | numpy.random.SeedSequence): Seed of all randomness in the model. City generation
+                and the dynamics use independent child streams, so models sharing a seed share the same city.
+                Use `rng.spawn_seeds` to give replicates or workers independent seeds.
+            collect_every (int | None): Collect the model reporters every `collect_every` steps (and after the
+                last of the `max_steps` steps); None collects after the last step only.
+            reporters (list | None): Names of the model reporters to collect; None collects all of them.
+                Expensive spatial statistics are only maintained when their reporter is requested.
+            population (Population | None): Households to simulate instead of generating a city, e.g. one city
+                shared by several scenarios (see `population.build_population` and `Population.load`). `seed`
+                then only drives the dynamics, and `num_agents` and `flag_random` are ignored.
+            metrics_sink (MetricsSink | None): Stream the collected reporters to disk instead of keeping them all
+                in memory; only the last collected row stays in the datacollector.
+            profile (bool): Time the phases of initialization and stepping and every model reporter in
+                `self.profiler` (see `profiling.PhaseTimer.summary`); when False the hooks do nothing.
         """
+        if engine not in ("agent", "array", "event"):
+            raise ValueError(f"Unknown engine '{engine}', expected 'agent', 'array' or 'event'.")
+        if collect_every is not None and collect_every < 1:
+            raise ValueError(f"collect_every must be None or at least 1, got {collect_every}.")
+        if population is not None:
+            if (population.width, population.height) != (width, height):
+                raise ValueError(f"The population was generated for a {population.width}x{population.height} grid, "
+                                 f"not {width}x{height}.")
+            num_agents = len(population)
+
+        self.profiler = PhaseTimer() if profile else NULL_TIMER
+        self.seed = as_seed_sequence(seed)
+        self.random = python_random(child_seed(self.seed, PLACEMENT_STREAM))  # Mesa's random API (unused by the model)
+        self.rng = numpy_generator(child_seed(self.seed, DYNAMICS_STREAM))  # subsidies and utility noise
 
         self.num_agents = num_agents
         self.grid = Grid(width, height)
         self.schedule = RandomActivation(self)
+        self.schedule._agents = {}  # insertion-ordered like Mesa's OrderedDict, at about half the memory per agent
         self.subsidy = subsidy  # Subsidy flag, 0 if government does not provide subsidy, 1 if it does
         self.running = True
         self.subsidy_timestep = subsidy_timestep # Timestep when subsidy is applied
         self.max_steps = max_steps
+        self.engine = engine
 
         self.beta1 = beta1
         self.beta2 = beta2
@@ -49,148 +98,70 @@ class CityModel(Model):
             2: {"count": 0, "houses": 0, "apartments": 0},
             3: {"count": 0, "houses": 0, "apartments": 0}
         }
+        # Number of households with solar panels per income level and apartment type, updated on adoption
+        self.solar_counts = {
+            1: {"houses": 0, "apartments": 0},
+            2: {"houses": 0, "apartments": 0},
+            3: {"houses": 0, "apartments": 0}
+        }
+        self.total_solar = 0
 
-        self.datacollector = DataCollector(
-            model_reporters={
-            "Low Income Solar House": lambda m: sum(1 for a in m.schedule.agents if a.income == 1 and a.solar_panels == 1 and a.type == 1),
-            "Low Income Solar Apartment": lambda m: sum(1 for a in m.schedule.agents if a.income == 1 and a.solar_panels == 1 and a.type == 2),
-            "Mid Income Solar House": lambda m: sum(1 for a in m.schedule.agents if a.income == 2 and a.solar_panels == 1 and a.type == 1),
-            "Mid Income Solar Apartment": lambda m: sum(1 for a in m.schedule.agents if a.income == 2 and a.solar_panels == 1 and a.type == 2),
-            "High Income Solar House": lambda m: sum(1 for a in m.schedule.agents if a.income == 3 and a.solar_panels == 1 and a.type == 1),
-            "High Income Solar Apartment": lambda m: sum(1 for a in m.schedule.agents if a.income == 3 and a.solar_panels == 1 and a.type == 2),
-            "Total Solar Panels": lambda m: sum(a.solar_panels for a in m.schedule.agents),
+        model_reporters = {
+            **adoption_count_reporters(),
             "Global Adoption Rate": compute_global_adoption,
             "Clustering Score": compute_clustering_score,
             "Moran's I": compute_morans_I,
             "Between-Class Gini": gini_between_income_classes
-            }
-        )
+        }
+        if reporters is not None:
+            unknown = [name for name in reporters if name not in model_reporters]
+            if unknown:
+                raise ValueError(f"Unknown reporters {unknown}, expected some of {list(model_reporters)}.")
+            model_reporters = {name: model_reporters[name] for name in reporters}
+        model_reporters = {name: self.profiler.wrap(f"reporter/{name}", reporter) for name, reporter in model_reporters.items()}
+        self.datacollector = DataCollector(model_reporters=model_reporters)
+        self.collect_every = collect_every
+        self.collected_steps = []  # step after which each row of the datacollector was collected
+        self.metrics_sink = metrics_sink
      
-        if flag_random == 0:
-            # 11 neighborhoods with different income distributions and spatial geometry
-            neighborhoods = [
-                {"x_range": (0, 84), "y_range": (0, 64), "income_dist": [1, 2, 3], "weights": [0.85, 0.15, 0.0]},     
-                {"x_range": (84, 120), "y_range": (66, 120), "income_dist": [1, 2, 3], "weights": [0.6, 0.39, 0.01]},     
-                {"x_range": (0, 39), "y_range": (38, 64), "income_dist": [1, 2, 3], "weights": [0.75, 0.25, 0.0]},    
-                {"x_range": (39, 51), "y_range": (46, 64), "income_dist": [2, 3, 1], "weights": [0.7, 0.2, 0.1]},    
-                {"x_range": (39, 51), "y_range": (38, 46), "income_dist": [2, 1, 3], "weights": [0.7, 0.2, 0.1]},   
-                {"x_range": (51, 57), "y_range": (38, 42), "income_dist": [2, 3, 1], "weights": [0.7, 0.2, 0.1]},   
-                {"x_range": (51, 94), "y_range": (42, 64), "income_dist": [3, 2, 1], "weights": [0.7, 0.3, 0.0]},    
-                {"x_range": (94, 120), "y_range": (42, 66), "income_dist": [2, 1, 3], "weights": [0.7, 0.1, 0.2]},    
-                {"x_range": (57, 120), "y_range": (0, 42), "income_dist": [3, 2, 1], "weights": [0.7, 0.3, 0.0]},    
-                {"x_range": (0, 84), "y_range": (64, 66), "income_dist": [3, 2, 1], "weights": [0.7, 0.3, 0.0]}, 
-                {"x_range": (0, 84), "y_range": (64, 120), "income_dist": [2, 3, 1], "weights": [0.7, 0.2, 0.1]} 
-            ]
-
-
-            for n in neighborhoods:
-                x_min, x_max = n["x_range"]
-                y_min, y_max = n["y_range"]
-                n["area"] = (x_max - x_min) * (y_max - y_min)
-
-            total_area = sum(n["area"] for n in neighborhoods)
-            area_weights = [n["area"] / total_area for n in neighborhoods]
-
-
-            next_id = 0  # track agent IDs
-
-            while next_id < self.num_agents:
-                # Select neighborhood based on area weight
-                neighborhood = random.choices(neighborhoods, weights=area_weights, k=1)[0]
-                x_min, x_max = neighborhood["x_range"]
-                y_min, y_max = neighborhood["y_range"]
-
-                # Random position within the selected neighborhood
-                x = self.random.randrange(x_min, x_max)
-                y = self.random.randrange(y_min, y_max)
-
-                agent = Household(next_id, self)
-                # Set income level based on neighborhood distribution
-                income = random.choices(neighborhood["income_dist"], weights=neighborhood["weights"])[0]
-                agent.set_income(income)
-                # Random environmental & behavioral traits
-                agent.set_environmental_consciousness(random.uniform(0, 1))
-                agent.set_stubborness_factor(random.uniform(0, 1))
-
-                # Set education and housing type based on income
-                if income == 1:
-                    education = random.choices([1, 2, 3], weights=[0.1, 0.6, 0.3])[0]
-                    agent_type = random.choices([1, 2], weights=[0.2, 0.8])[0]
-                elif income == 2:
-                    education = random.choices([1, 2, 3], weights=[0.05, 0.2, 0.75])[0]
-                    agent_type = random.choices([1, 2], weights=[0.5, 0.5])[0]
-                else:
-                    education = random.choices([1, 2, 3], weights=[0.01, 0.1, 0.89])[0]
-                    agent_type = random.choices([1, 2], weights=[0.8, 0.2])[0]
+        # Generate all households at once (unless a city is given), then turn them into agents on the grid
+        if population is None:
+            with self.profiler.phase("init/population"):
+                population = build_population(width, height, num_agents, flag_random, self.seed)
+        self.population = population
+        self._add_households(population)
 
-                agent.set_education_level(education)
-                agent.set_subsidy(0)
-                placed = False
-                max_tries = 100
-                for _ in range(max_tries):
-                    x = self.random.randrange(x_min, x_max)
-                    y = self.random.randrange(y_min, y_max)
-                    contents = self.grid.get_cell_list_contents((x, y))
-
-                    if agent_type == 1: # House: cell must be empty
-                        if not contents:
-                            placed = True
-                            break
-                    elif agent_type == 2: # Apartment: can share cell with other apartments
-                        if all(a.type == 2 for a in contents):
-                            placed = True
-                            break
-                if not placed:
-                    continue  
+        # Households never move, so their neighbors are looked up once
+        with self.profiler.phase("init/neighbours and rasters"):
+            self.neighbours = population.neighbours
+            self.household_list = sorted(self.schedule.agents, key=lambda a: a.unique_id)
+            for agent, num_neighbours in zip(self.household_list, self.neighbours.degree().tolist()):
+                agent.num_neighbours = num_neighbours
+            self.rasters = CellRasters.from_agents(self.household_list, width, height)
+            self.morans_I = AdoptionMoran(self.rasters) if "Moran's I" in model_reporters else None
 
-                agent.set_type(agent_type)
-                self.grid.place_agent(agent, (x, y))
-                self.schedule.add(agent)
-                self.incomes[income]["count"] += 1
-                if agent_type == 1:
-                    self.incomes[income]["houses"] += 1
-                else:
-                    self.incomes[income]["apartments"] += 1
-                next_id += 1
-            
-        else:
-            # Randomly place agents across the grid without neighborhood structure
-            next_id = 0
-            while next_id < self.num_agents:  
-                agent = Household(next_id, self)
-                # Randomly assign income level
-                income = self.random.choice([1, 2, 3])
+        # The array engine can snapshot the households once they are placed
+        with self.profiler.phase("init/engine"):
+            self.households = HouseholdArrays(self.household_list, self.rasters) if engine != "agent" else None
+            self.events = EventEngine(self.households, self.neighbours, self.rng) if engine == "event" else None
+
+        if self.should_collect(0):
+            self.collect()
+
+    def _add_households(self, population):
+        """Create a Household agent for every household of `population` and place it on the grid."""
+        with self.profiler.phase("init/agents"):
+            for unique_id, (income, education, agent_type, consciousness, stubbornness, x, y) in enumerate(zip(
+                    population.income.tolist(), population.education_level.tolist(), population.type.tolist(),
+                    population.environmental_consciousness.tolist(), population.stubborness_factor.tolist(),
+                    population.x.tolist(), population.y.tolist())):
+                agent = Household(unique_id, self)
                 agent.set_income(income)
-                # Random environmental & behavioral traits
-                agent.set_environmental_consciousness(self.random.uniform(0, 1))
-                agent.set_stubborness_factor(self.random.uniform(0, 1))
-
-                # Set education and housing type 
-                education = self.random.choices([1, 2, 3])[0]
-                agent_type = self.random.choices([1, 2])[0]
-                
-                agent.set_type(agent_type)
+                agent.set_environmental_consciousness(consciousness)
+                agent.set_stubborness_factor(stubbornness)
                 agent.set_education_level(education)
+                agent.set_type(agent_type)
                 agent.set_subsidy(0)
-                
-                placed = False
-                max_tries = 100
-                for _ in range(max_tries):
-                    x = self.random.randrange(self.grid.width)
-                    y = self.random.randrange(self.grid.height)
-                    contents = self.grid.get_cell_list_contents((x,y))
-
-                    if agent_type == 1: # House: cell must be empty
-                        if not contents:
-                            placed = True
-                            break
-                    elif agent_type == 2: # Apartment: can share cell with other apartments
-                        if all(a.type == 2 for a in contents):
-                            placed = True
-                            break
-                if not placed:
-                    continue
-                
                 self.grid.place_agent(agent, (x, y))
                 self.schedule.add(agent)
                 self.incomes[income]["count"] += 1
@@ -198,11 +169,6 @@ class CityModel(Model):
                     self.incomes[income]["houses"] += 1
                 else:
                     self.incomes[income]["apartments"] += 1
-                next_id += 1
-            
-        self.datacollector.collect(self)
-        
-    
 
     def step(self):
         """AAdvance the model by one step. If the step is the subsidy timestep and
@@ -215,31 +181,228 @@ class CityModel(Model):
 
         # Apply subsidies at configured timestep
         if self.schedule.time == self.subsidy_timestep and self.subsidy == 1:
-            for agent in self.schedule.agents:
-                if agent.income == 1:
-                    agent.set_subsidy(1)
-                elif agent.income == 2:
-                    agent.set_subsidy(1 if random.random() < 0.4 else 0)
+            with self.profiler.phase("step/subsidy"):
+                draws = self.rng.random(len(self.household_list))
+                if self.engine != "agent":
+                    self.households.apply_subsidy(draws)
+                    if self.events is not None:
+                        self.events.invalidate()
                 else:
-                    agent.set_subsidy(0)
+                    for agent, draw in zip(self.household_list, draws.tolist()):
+                        if agent.income == 1:
+                            agent.set_subsidy(1)
+                        elif agent.income == 2:
+                            agent.set_subsidy(1 if draw < 0.4 else 0)
+                        else:
+                            agent.set_subsidy(0)
 
-        agents = self.schedule._agents
-        agent_keys = list(agents.keys())
-        for key in agent_keys:
-            if key in agents:
-                agents[key].step(self.grid, self, self.beta1, self.beta2, self.beta3, self.beta4, self.beta5, self.beta6, self.beta7)
+        if self.engine == "event":
+            with self.profiler.phase("step/dynamics"):
+                self.events.step(self, self.beta1, self.beta2, self.beta3, self.beta4, self.beta5, self.beta6, self.beta7)
+        elif self.engine == "array":
+            # One noise draw per household (adopters included, so the stream does not depend on adoption)
+            with self.profiler.phase("step/noise"):
+                noise = self.rng.normal(0, 0.5, size=len(self.household_list))
+            with self.profiler.phase("step/dynamics"):
+                self.households.step(self, self.beta1, self.beta2, self.beta3, self.beta4, self.beta5, self.beta6, self.beta7, noise)
+        else:
+            with self.profiler.phase("step/noise"):
+                noise = self.rng.normal(0, 0.5, size=len(self.household_list)).tolist()
+            with self.profiler.phase("step/dynamics"):
+                agents = self.schedule._agents
+                agent_keys = list(agents.keys())
+                for key in agent_keys:
+                    if key in agents:
+                        agents[key].step(self.grid, self, self.beta1, self.beta2, self.beta3, self.beta4, self.beta5, self.beta6, self.beta7, noise[key])
 
-        self.datacollector.collect(self)
+        if self.should_collect(self.schedule.time + 1):
+            self.collect(self.schedule.time + 1)
         self.schedule.time += 1
         
     
-    def run_model(self, steps=100):
-        """Run the model for a specified number of steps."""
+    def record_adoption(self, agent):
+        """Increment the solar-neighbor counter of every household that has `agent` as a neighbor,
+        and update the per-cell rasters, spatial statistics and adoption counters."""
+        households = self.household_list
+        with self.profiler.phase("adoption/neighbour counters"):
+            for i in self.neighbours.neighbours_of(agent.unique_id):
+                households[i].solar_neighbours += 1
+        if self.morans_I is not None:
+            with self.profiler.phase("adoption/moran's I"):
+                self.morans_I.add_adopter(agent.pos)
+        self.rasters.add_adopter(agent.pos)
+        self.solar_counts[agent.income]["houses" if agent.type == 1 else "apartments"] += 1
+        self.total_solar += 1
+
+    def should_collect(self, steps_done):
+        """Whether the collection policy asks for the reporters after `steps_done` steps."""
+        if steps_done == self.max_steps:
+            return True
+        return self.collect_every is not None and steps_done % self.collect_every == 0
+
+    def collect(self, steps_done=0):
+        """Collect the model reporters for the state after `steps_done` steps."""
+        if self.collected_steps and self.collected_steps[-1] == steps_done:
+            return
+        with self.profiler.phase("collect"):
+            self._collect(steps_done)
+
+    def _collect(self, steps_done):
+        """Append the reporter values of the state after `steps_done` steps (see `collect`)."""
+        if self.collected_steps and self._collected_total_solar == self.total_solar:
+            # All reporters depend only on who has adopted: nobody did since the last row, so repeat it
+            for values in self.datacollector.model_vars.values():
+                values.append(values[-1])
+        else:
+            self.datacollector.collect(self)
+        self.collected_steps.append(steps_done)
+        self._collected_total_solar = self.total_solar
+        if self.metrics_sink is not None:
+            model_vars = self.datacollector.model_vars
+            self.metrics_sink.write(steps_done, {name: values[-1] for name, values in model_vars.items()})
+            # Only the last row is kept, to be repeated while nobody adopts
+            for values in model_vars.values():
+                del values[:-1]
+            del self.collected_steps[:-1]
+
+    def get_model_vars_dataframe(self):
+        """The collected model reporters as a DataFrame indexed by the step they were collected after."""
+        if self.metrics_sink is not None:
+            self.metrics_sink.flush()
+            return read_metrics(self.metrics_sink.directory)
+        return pd.DataFrame(self.datacollector.model_vars, index=pd.Index(self.collected_steps, name="Step"))
+
+    def save_checkpoint(self, path):
+        """
+        Save the complete simulation state to the npz file `path`.
+
+        The checkpoint holds the city, the adoption and subsidy state of every household, the
+        schedule time, the state of both random streams, the spatial statistics, the pending
+        adoption events of the event engine and the metrics collected so far, so a model
+        restored with `from_checkpoint` continues exactly as this one would. The file is
+        written to a temporary name first, so a crash while saving keeps the previous checkpoint.
+        With a metrics sink, the sink is flushed and the checkpoint only holds the last collected row.
+
+        Args:
+            path (str): Checkpoint file.
+        """
+        if self.metrics_sink is not None:
+            self.metrics_sink.flush()
+        reporters = list(self.datacollector.model_reporters)
+        state = {
+            "params": {"width": self.grid.width, "height": self.grid.height, "subsidy": self.subsidy,
+                       "subsidy_timestep": self.subsidy_timestep, "max_steps": self.max_steps,
+                       "beta1": self.beta1, "beta2": self.beta2, "beta3": self.beta3, "beta4": self.beta4,
+                       "beta5": self.beta5, "beta6": self.beta6, "beta7": self.beta7, "engine": self.engine,
+                       "collect_every": self.collect_every, "reporters": reporters,
+                       "profile": self.profiler.enabled},
+            "seed": {"entropy": self.seed.entropy, "spawn_key": list(self.seed.spawn_key),
+                     "pool_size": self.seed.pool_size},
+            "time": self.schedule.time,
+            "running": self.running,
+            "rng": self.rng.bit_generator.state,
+            "random": self.random.getstate(),
+            "collected_steps": self.collected_steps,
+            "collected_total_solar": getattr(self, "_collected_total_solar", None),
+        }
+        arrays = {f"population_{name}": values for name, values in self.population.to_arrays().items()}
+        arrays["solar_panels"] = np.array([a.solar_panels for a in self.household_list], dtype=np.int8)
+        arrays["subsidy"] = np.array([a.subsidy for a in self.household_list], dtype=np.int8)
+        for k, name in enumerate(reporters):
+            arrays[f"metric_{k}"] = np.asarray(self.datacollector.model_vars[name])
+        if self.morans_I is not None:
+            arrays["moran_values"] = self.morans_I.values
+            arrays["moran_sums"] = np.array([self.morans_I.total, self.morans_I.total_sq, self.morans_I.cross,
+                                             self.morans_I.col_dot, self.morans_I.row_dot])
+        if self.events is not None:
+            state["events"] = {"key": self.events._key, "stale": self.events._stale}
+            queue = self.events.queue
+            arrays["event_steps"] = np.array([event[0] for event in queue], dtype=float)
+            arrays["event_versions"] = np.array([event[1] for event in queue], dtype=np.int64)
+            arrays["event_households"] = np.array([event[2] for event in queue], dtype=np.int64)
+            arrays["event_version"] = self.events.version
+
+        temporary = f"{path}.tmp.npz"
+        np.savez_compressed(temporary, state=np.array(json.dumps(state)), **arrays)
+        os.replace(temporary, path)
+
+    @classmethod
+    def from_checkpoint(cls, path, metrics_sink=None):
+        """
+        Restore a model saved with `save_checkpoint`.
+
+        Args:
+            path (str): Checkpoint file.
+            metrics_sink (MetricsSink | None): Sink the saved run streamed its metrics to, opened with
+                `append=True`; the rows written after the checkpoint are dropped from it.
+
+        Returns:
+            CityModel: The model, ready to continue stepping where the saved one stopped.
+        """
+        with np.load(path) as checkpoint:
+            arrays = {name: checkpoint[name] for name in checkpoint.files}
+        state = json.loads(arrays["state"].item())
+        population = Population.from_arrays({name[len("population_"):]: values for name, values in arrays.items()
+                                             if name.startswith("population_")})
+        seed = np.random.SeedSequence(state["seed"]["entropy"], spawn_key=tuple(state["seed"]["spawn_key"]),
+                                      pool_size=state["seed"]["pool_size"])
+        model = cls(**state["params"], seed=seed, population=population)
+        model._restore_state(state, arrays)
+        if metrics_sink is not None:
+            metrics_sink.truncate(model.schedule.time)
+            model.metrics_sink = metrics_sink
+        return model
+
+    def _restore_state(self, state, arrays):
+        """Overwrite the freshly initialized dynamics with the state of a checkpoint."""
+        for agent, subsidy in zip(self.household_list, arrays["subsidy"].tolist()):
+            agent.set_subsidy(subsidy)
+        # Adopting through the usual hook rebuilds the neighbor counters, rasters and adoption counts
+        for i in np.flatnonzero(arrays["solar_panels"]).tolist():
+            self.household_list[i].set_solar_panels(1)
+        if self.morans_I is not None:
+            self.morans_I.values = arrays["moran_values"].copy()
+            (self.morans_I.total, self.morans_I.total_sq, self.morans_I.cross,
+             self.morans_I.col_dot, self.morans_I.row_dot) = arrays["moran_sums"].tolist()
+        if self.households is not None:
+            self.households = HouseholdArrays(self.household_list, self.rasters)
+        if self.events is not None:
+            self.events = EventEngine(self.households, self.neighbours, self.rng)
+            key = state["events"]["key"]
+            self.events._key = tuple(key) if key is not None else None
+            self.events._stale = state["events"]["stale"]
+            self.events.version = arrays["event_version"].copy()
+            self.events.queue = list(zip(arrays["event_steps"].tolist(), arrays["event_versions"].tolist(),
+                                         arrays["event_households"].tolist()))
+
+        for k, name in enumerate(state["params"]["reporters"]):
+            self.datacollector.model_vars[name] = arrays[f"metric_{k}"].tolist()
+        self.collected_steps = state["collected_steps"]
+        self._collected_total_solar = state["collected_total_solar"]
+        self.schedule.time = state["time"]
+        self.running = state["running"]
+        self.rng.bit_generator.state = state["rng"]
+        version, internal_state, gauss_next = state["random"]
+        self.random.setstate((version, tuple(internal_state), gauss_next))
+
+    def run_model(self, steps=100, checkpoint_every=None, checkpoint_path=None):
+        """
+        Run the model for a specified number of steps, collecting the reporters after the last one.
+
+        Args:
+            steps (int): Number of steps to run.
+            checkpoint_every (int | None): Save a checkpoint to `checkpoint_path` every `checkpoint_every`
+                steps of model time (see `save_checkpoint`); None never checkpoints.
+            checkpoint_path (str | None): Checkpoint file, overwritten by every new checkpoint.
+        """
         for i in range(steps):
             self.step()
             #print(f"Step {i + 1}/{steps} completed.")
+            if checkpoint_every is not None and self.schedule.time % checkpoint_every == 0:
+                self.save_checkpoint(checkpoint_path)
             if not self.running:
                 break
+        self.collect(self.schedule.time)
 
 
         
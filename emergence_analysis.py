@@ -1,46 +1,188 @@
+from functools import lru_cache
 import numpy as np
-from libpysal.weights import lat2W
-from esda.moran import Moran
+from scipy.sparse import csr_matrix
+
+
+INCOME_LABELS = {1: "Low", 2: "Mid", 3: "High"}
+
+
+def adoption_count_reporters():
+    """
+    Reporters for the number of solar panel adopters per income level and dwelling type,
+    read from the counters the model updates whenever a household adopts.
+
+    Returns:
+        dict: Reporter functions mapping reporter names to functions of the model.
+    """
+    reporters = {}
+    for income, label in INCOME_LABELS.items():
+        reporters[f"{label} Income Solar House"] = lambda m, income=income: m.solar_counts[income]["houses"]
+        reporters[f"{label} Income Solar Apartment"] = lambda m, income=income: m.solar_counts[income]["apartments"]
+    reporters["Total Solar Panels"] = lambda m: m.total_solar
+    return reporters
 
 
 def compute_global_adoption(model):
     """Calculate the global adoption rate of solar panels in the model."""
-    adopters = sum(1 for a in model.schedule.agents if a.solar_panels == 1)
-    return adopters / model.num_agents
+    return model.total_solar / model.num_agents
+
+
+def clustering_terms(rasters, region=(slice(None), slice(None))):
+    """
+    Sum of the adopting-neighbor fractions of all adopters, and the number of adopters counted,
+    over the cells in `region` of the rasters (e.g. one tile of a partitioned city without its halo).
+
+    Returns:
+        tuple: (sum of fractions, number of adopters); the clustering score is their ratio.
+    """
+    neighbour_adopters, neighbours = rasters.neighbourhood_counts()
+    neighbour_adopters, neighbours, adopters = neighbour_adopters[region], neighbours[region], rasters.adopters[region]
+    # All adopters of a cell share the same neighborhood; adopters without neighbors are skipped
+    counted = (adopters > 0) & (neighbours > 0)
+    adopters = adopters[counted]
+    return (adopters * neighbour_adopters[counted] / neighbours[counted]).sum(), adopters.sum()
+
+
+def clustering_score(rasters):
+    """Average fraction of Moore neighbors of adopters that are also adopters, from per-cell counts."""
+    fractions, num_adopters = clustering_terms(rasters)
+    if num_adopters == 0:
+        return 0
+    return fractions / num_adopters
 
 
 def compute_clustering_score(model):
     """Average fraction of Moore neighbors of adopters that are also adopters."""
-    cluster_scores = []
-    for agent in model.schedule.agents:
-        neighbors = []
-        # Separate between apartments and houses
-        if agent.type == 2:  
-            if agent.solar_panels == 1:
-                neighbors = model.grid.get_neighbors(agent.pos, include_center=True)
-        else:
-            if agent.solar_panels == 1:
-                neighbors = model.grid.get_neighbors(agent.pos, include_center=False)
-        if neighbors:
-            adopter_neighbors = sum(1 for n in neighbors if n.solar_panels == 1)
-            cluster_scores.append(adopter_neighbors / len(neighbors))
-            
-    return sum(cluster_scores) / len(cluster_scores) if cluster_scores else 0
+    return clustering_score(model.rasters)
 
 
-def compute_morans_I(model):
-    """Calculate Moran's I for solar panel adoption across the grid."""
-    grid_w, grid_h = model.grid.width, model.grid.height
-    grid_array = np.zeros((grid_w, grid_h))
+class LatticeWeights:
+    """Row-standardized rook contiguity weights of a grid as sparse matrices, with the sums Moran's I needs."""
 
-    for agent in model.schedule.agents:
-        x, y = agent.pos
-        grid_array[x, y] = 1 if agent.solar_panels == 1 else 0
+    def __init__(self, width, height):
+        """
+        Build the weights of a width x height grid; cell (x, y) is row x * height + y.
 
-    flat = grid_array.flatten()
-    w = lat2W(grid_w, grid_h)  # spatial weight matrix
-    moran = Moran(flat, w)
-    return moran.I
+        Args:
+            width (int): Width of the grid.
+            height (int): Height of the grid.
+        """
+        # Rook neighbors (the pairs of horizontally or vertically adjacent cells), as libpysal's lat2W,
+        # built with NumPy so that grids of millions of cells need no per-cell Python objects
+        n = width * height
+        cells = np.arange(n).reshape(width, height)
+        pairs = [(cells[1:, :], cells[:-1, :]), (cells[:, 1:], cells[:, :-1])]
+        rows = np.concatenate([c.ravel() for a, b in pairs for c in (a, b)])
+        cols = np.concatenate([c.ravel() for a, b in pairs for c in (b, a)])
+        degree = np.bincount(rows, minlength=n)
+        # Row-standardized, as esda.Moran uses by default
+        self.matrix = csr_matrix((1.0 / degree[rows], (rows, cols)), shape=(n, n))
+        self.symmetric = (self.matrix + self.matrix.T).tocsr()  # W + W^T, for the incremental cross product
+        self.row_sums = np.asarray(self.matrix.sum(axis=1)).ravel()
+        self.col_sums = np.asarray(self.matrix.sum(axis=0)).ravel()
+        self.s0 = self.matrix.sum()
+        self.n = width * height
+
+
+@lru_cache(maxsize=None)
+def lattice_weights(width, height):
+    """Spatial weights of a grid shape, built once and shared by every model with that shape."""
+    return LatticeWeights(width, height)
+
+
+def morans_I_from_sums(n, s0, total, total_sq, cross, col_dot, row_dot):
+    """
+    Moran's I from the sums `IncrementalMoran` keeps (see there); all sums are additive over cells,
+    so the sums of disjoint parts of a grid can be added up first.
+
+    Returns:
+        float: Moran's I, nan when all cells have the same value.
+    """
+    mean = total / n
+    z_squares = total_sq - n * mean * mean
+    if z_squares <= 1e-12 * max(total_sq, 1.0):
+        return float("nan")
+    z_lag = cross - mean * (col_dot + row_dot) + mean * mean * s0
+    return n / s0 * z_lag / z_squares
+
+
+class IncrementalMoran:
+    """
+    Moran's I of a raster of cell values, updated in O(neighbors) when a single cell changes.
+
+    With z = y - mean(y), Moran's I is n / S0 * z'Wz / z'z, where
+    z'Wz = y'Wy - mean * (colsums . y + rowsums . y) + mean^2 * S0 and z'z = sum(y^2) - n * mean^2.
+    Those sums are kept up to date instead of rebuilding the statistic every step.
+    The weights must have a zero diagonal, as lattice weights do.
+    """
+
+    def __init__(self, values, weights):
+        """
+        Args:
+            values (numpy.ndarray): Initial value of every cell, flattened as in `LatticeWeights`.
+            weights (LatticeWeights): Spatial weights of the grid.
+        """
+        self.weights = weights
+        self.values = np.asarray(values, dtype=float).ravel().copy()
+        self.recompute()
+
+    def recompute(self):
+        """Recompute all sums from scratch (e.g. to remove accumulated rounding)."""
+        y = self.values
+        self.total = y.sum()
+        self.total_sq = y @ y
+        self.cross = y @ (self.weights.matrix @ y)
+        self.col_dot = self.weights.col_sums @ y
+        self.row_dot = self.weights.row_sums @ y
+
+    def add(self, cell, delta):
+        """Add `delta` to the value of the flat cell index `cell`."""
+        symmetric = self.weights.symmetric
+        start, end = symmetric.indptr[cell], symmetric.indptr[cell + 1]
+        old = self.values[cell]
+        self.cross += delta * (symmetric.data[start:end] @ self.values[symmetric.indices[start:end]])
+        self.total += delta
+        self.total_sq += delta * (2 * old + delta)
+        self.col_dot += delta * self.weights.col_sums[cell]
+        self.row_dot += delta * self.weights.row_sums[cell]
+        self.values[cell] = old + delta
+
+    @property
+    def I(self):
+        """Current value of Moran's I (nan while all cells have the same value)."""
+        return morans_I_from_sums(self.weights.n, self.weights.s0, self.total, self.total_sq, self.cross,
+                                  self.col_dot, self.row_dot)
+
+
+class AdoptionMoran(IncrementalMoran):
+    """Moran's I of the share of households with solar panels in each grid cell."""
+
+    def __init__(self, rasters):
+        """
+        Build the raster of shares from the model's per-cell counts; empty cells count as 0,
+        and every household of a cell (several apartments can share one) weighs 1 / occupants.
+
+        Args:
+            rasters (CellRasters): The model's per-cell household counts.
+        """
+        self.rasters = rasters
+        super().__init__(rasters.adopter_share(), lattice_weights(rasters.width, rasters.height))
+
+    def add_adopter(self, pos):
+        """Register a household at grid position `pos` that installed solar panels."""
+        x, y = pos
+        self.add(x * self.rasters.height + y, 1 / self.rasters.occupants[x, y])
+
+
+def morans_I_from_raster(raster):
+    """Moran's I of a (width, height) raster computed from scratch with the cached lattice weights."""
+    width, height = raster.shape
+    return IncrementalMoran(raster, lattice_weights(width, height)).I
+
+
+def compute_morans_I(model):
+    """Moran's I of the share of adopting households per cell, maintained incrementally by the model."""
+    return model.morans_I.I
 
 def gini_coefficient(values):
     """Calculate the Gini coefficient from a list or array of values."""
@@ -61,12 +203,11 @@ def gini_between_income_classes(model):
     adoption_fractions = []
 
     for income in income_levels:
-        income_agents = [a for a in model.schedule.agents if a.income == income]
-        n = len(income_agents)
+        n = model.incomes[income]["count"]
         if n == 0:
             adoption_fractions.append(0.0)
         else:
-            adopted = sum(a.solar_panels for a in income_agents)
+            adopted = model.solar_counts[income]["houses"] + model.solar_counts[income]["apartments"]
             fraction = adopted / n
             adoption_fractions.append(fraction)
 
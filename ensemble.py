@@ -0,0 +1,142 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from emergence_analysis import INCOME_LABELS
+from household import UTILITY_CUTOFF, CUTOFF_MARGIN
+from raster import CellRasters
+from rng import child_seed, numpy_generator, DYNAMICS_STREAM
+
+# Per-scenario parameters and their CityModel defaults
+SCENARIO_DEFAULTS = {"beta1": 0.35, "beta2": 0.05, "beta3": 0.5, "beta4": 0.2, "beta5": 0.3, "beta6": 0.3,
+                     "beta7": 0.6, "subsidy": 1, "subsidy_timestep": 0}
+
+
+class Ensemble:
+    """
+    Many scenarios (betas, subsidy flag and subsidy timestep) simulated at once on one shared city.
+
+    The adoption state of all scenarios is an S x N matrix (scenarios x households). Each step
+    counts the adopting neighbors of every household in every scenario with one sparse
+    matrix product with the city's neighbor adjacency, and applies the probit adoption rule to
+    the whole matrix, as the array engine does for a single model: adoptions take effect on
+    neighbors from the next step onwards.
+
+    Every scenario draws its subsidies and noise from the dynamics stream of its own seed, so
+    scenario s gives exactly the adoptions of `CityModel(engine="array", seed=seeds[s],
+    population=population)` with the scenario's parameters.
+    """
+
+    def __init__(self, population, scenarios, seeds):
+        """
+        Args:
+            population (Population): The city shared by all scenarios.
+            scenarios (list): One dict per scenario with any of the keys of `SCENARIO_DEFAULTS`;
+                missing keys take the CityModel defaults.
+            seeds (list): Model seed of every scenario (None | int | numpy.random.SeedSequence).
+        """
+        if len(seeds) != len(scenarios):
+            raise ValueError(f"Got {len(seeds)} seeds for {len(scenarios)} scenarios.")
+        for scenario in scenarios:
+            unknown = [name for name in scenario if name not in SCENARIO_DEFAULTS]
+            if unknown:
+                raise ValueError(f"Unknown scenario parameters {unknown}, expected some of {list(SCENARIO_DEFAULTS)}.")
+        self.population = population
+        self.scenarios = [{**SCENARIO_DEFAULTS, **scenario} for scenario in scenarios]
+        # One (S, 1) column per parameter, broadcasting over the households
+        self.params = {name: np.array([s[name] for s in self.scenarios], dtype=float)[:, None]
+                       for name in SCENARIO_DEFAULTS}
+        self.subsidy_timestep = np.array([s["subsidy_timestep"] for s in self.scenarios])
+        self.subsidy_enabled = np.array([s["subsidy"] for s in self.scenarios]) == 1
+        self.rngs = [numpy_generator(child_seed(seed, DYNAMICS_STREAM)) for seed in seeds]
+
+        neighbours = population.neighbours
+        n = len(population)
+        self.adjacency = csr_matrix((np.ones(len(neighbours.indices)), neighbours.indices, neighbours.indptr),
+                                    shape=(n, n))
+        self.num_neighbours = neighbours.degree()
+        self.income = population.income
+        self.type = population.type
+
+        self.time = 0
+        self.subsidy = np.zeros((len(self.scenarios), n), dtype=np.int8)
+        self.solar_panels = np.zeros((len(self.scenarios), n), dtype=np.int8)
+        self._static_utility = None
+
+    def fraction_with_solar(self):
+        """(S, N) fraction of every household's neighbors with solar panels in every scenario (0 without neighbors)."""
+        # The adjacency is symmetric, so A @ state^T counts the adopting neighbors of every household
+        neighbour_adopters = (self.adjacency @ self.solar_panels.T.astype(float)).T
+        return np.divide(neighbour_adopters, self.num_neighbours, out=np.zeros(neighbour_adopters.shape),
+                         where=self.num_neighbours > 0)
+
+    def apply_subsidies(self, scenarios):
+        """Draw the subsidies of the `scenarios` (indices) as `HouseholdArrays.apply_subsidy` does."""
+        for s in scenarios.tolist():
+            draws = self.rngs[s].random(len(self.income))
+            mid_income_draws = draws < 0.4
+            self.subsidy[s] = np.where(self.income == 1, 1, np.where(self.income == 2, mid_income_draws, 0))
+        self._static_utility = None
+
+    def static_utility(self):
+        """(S, N) utility terms that stay fixed between subsidy changes, cached."""
+        if self._static_utility is None:
+            p, population = self.params, self.population
+            self._static_utility = (p["beta1"] * (population.income / 3) + p["beta2"] * population.environmental_consciousness
+                                    - p["beta4"] * population.stubborness_factor + p["beta5"] * (population.education_level / 3)
+                                    + p["beta6"] * self.subsidy * p["subsidy"] + p["beta7"] * (1 - population.type))
+        return self._static_utility
+
+    def utility(self, scenario, household, fraction_with_solar, noise):
+        """Utility of the (scenario, household) pairs, in the same order of operations as `Household.utility`."""
+        p, population = {name: value[scenario, 0] for name, value in self.params.items()}, self.population
+        return (p["beta1"] * (population.income[household] / 3) + p["beta2"] * population.environmental_consciousness[household]
+                + p["beta3"] * fraction_with_solar - p["beta4"] * population.stubborness_factor[household]
+                + p["beta5"] * (population.education_level[household] / 3)
+                + p["beta6"] * self.subsidy[scenario, household] * p["subsidy"]
+                + p["beta7"] * (1 - population.type[household]) + noise)
+
+    def step(self):
+        """Advance all scenarios by one step."""
+        subsidised = np.flatnonzero(self.subsidy_enabled & (self.subsidy_timestep == self.time))
+        if len(subsidised):
+            self.apply_subsidies(subsidised)
+        # Every scenario draws its noise from its own stream exactly as `CityModel.step` does
+        noise = np.stack([rng.normal(0, 0.5, size=len(self.income)) for rng in self.rngs])
+
+        fraction_with_solar = self.fraction_with_solar()
+        utility = self.static_utility() + self.params["beta3"] * fraction_with_solar + noise
+        close = np.nonzero(np.abs(utility - UTILITY_CUTOFF) < CUTOFF_MARGIN)
+        if len(close[0]):
+            utility[close] = self.utility(*close, fraction_with_solar[close], noise[close])
+        self.solar_panels[(self.solar_panels == 0) & (utility >= UTILITY_CUTOFF)] = 1
+        self.time += 1
+
+    def run(self, steps):
+        """Advance all scenarios by `steps` steps."""
+        for _ in range(steps):
+            self.step()
+
+    def total_solar(self):
+        """Number of adopters of every scenario."""
+        return self.solar_panels.sum(axis=1, dtype=np.int64)
+
+    def cell_rasters(self, scenario):
+        """Per-cell household and adopter counts of one scenario, e.g. for the spatial metrics of its final state."""
+        population = self.population
+        return CellRasters(population.x, population.y, population.type, self.solar_panels[scenario],
+                           population.width, population.height)
+
+    def adoption_counts(self):
+        """
+        Adopters per income level and dwelling type of every scenario.
+
+        Returns:
+            pandas.DataFrame: One row per scenario, with the columns of `adoption_count_reporters`.
+        """
+        counts = {}
+        for level, label in INCOME_LABELS.items():
+            for dwelling, name in ((1, "House"), (2, "Apartment")):
+                members = (self.income == level) & (self.type == dwelling)
+                counts[f"{label} Income Solar {name}"] = self.solar_panels[:, members].sum(axis=1, dtype=np.int64)
+        counts["Total Solar Panels"] = self.total_solar()
+        return pd.DataFrame(counts)
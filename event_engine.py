@@ -0,0 +1,109 @@
+import heapq
+import numpy as np
+from scipy.stats import norm
+from household import UTILITY_CUTOFF
+from neighbors import ragged_arange
+
+NOISE_SD = 0.5  # standard deviation of the utility noise
+
+
+class EventEngine:
+    """
+    Next-event simulation of the adoption dynamics.
+
+    Between two changes of its neighborhood (or of the subsidies/betas), a household without
+    solar panels adopts in every step with the same probability
+    P(noise >= cutoff - static utility - beta3 * fraction_with_solar), so the step at which it
+    adopts is geometrically distributed. Instead of evaluating every household in every step,
+    the engine samples these waiting times, keeps the adoption events in a priority queue and
+    only resamples the households whose neighborhood changed. Steps without events cost
+    O(1). Adoptions influence the neighbors from the next step on, as in the array engine,
+    so both engines follow the same distribution.
+    """
+
+    def __init__(self, households, neighbours, rng):
+        """
+        Args:
+            households (HouseholdArrays): Struct-of-arrays state of the households.
+            neighbours (NeighborIndex): Static neighbor index of the households.
+            rng (numpy.random.Generator): Random stream of the dynamics.
+        """
+        self.households = households
+        self.neighbours = neighbours
+        self.rng = rng
+        self.num_neighbours = neighbours.degree()
+        self.solar_neighbours = np.zeros(len(self.num_neighbours), dtype=np.int64)
+        adopters = np.flatnonzero(households.solar_panels == 1)
+        np.add.at(self.solar_neighbours, self._neighbours_of(adopters), 1)
+
+        self.queue = []  # (adoption step, version, household index)
+        self.version = np.zeros(len(self.num_neighbours), dtype=np.int64)  # outdated events are skipped
+        self._key = None  # betas and subsidy flag the queued events were sampled with
+        self._stale = True
+
+    def _neighbours_of(self, index):
+        """Concatenated neighbor lists of the households at `index`."""
+        indptr = self.neighbours.indptr
+        return self.neighbours.indices[ragged_arange(indptr[index], indptr[index + 1] - indptr[index])]
+
+    def invalidate(self):
+        """Resample every pending household at the next step (e.g. after the subsidies changed)."""
+        self._stale = True
+
+    def adoption_probability(self, citymodel, beta1, beta2, beta3, beta4, beta5, beta6, beta7, index):
+        """Per-step adoption probability of the households at `index` given their current neighborhood."""
+        static = self.households.static_utility(citymodel, beta1, beta2, beta4, beta5, beta6, beta7)[index]
+        fraction_with_solar = np.divide(self.solar_neighbours[index], self.num_neighbours[index],
+                                        out=np.zeros(len(index)), where=self.num_neighbours[index] > 0)
+        return norm.sf((UTILITY_CUTOFF - static - beta3 * fraction_with_solar) / NOISE_SD)
+
+    def schedule(self, citymodel, betas, index, first_step):
+        """Sample the adoption step of the households at `index`, counting from `first_step`."""
+        index = index[self.households.solar_panels[index] == 0]
+        self.version[index] += 1
+        probability = self.adoption_probability(citymodel, *betas, index)
+        # Geometric number of steps until adoption (1 = adopt at first_step), by inversion
+        uniform = 1.0 - self.rng.random(len(index))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            waiting = np.floor(np.log(uniform) / np.log1p(-probability)) + 1
+        waiting[probability <= 0] = np.inf
+        for i, wait, version in zip(index.tolist(), waiting.tolist(), self.version[index].tolist()):
+            if wait < np.inf:
+                heapq.heappush(self.queue, (first_step + wait - 1, version, i))
+
+    def step(self, citymodel, beta1, beta2, beta3, beta4, beta5, beta6, beta7):
+        """
+        Process the adoption events of the current step.
+
+        Returns:
+            numpy.ndarray: Indices of the households that adopted in this step.
+        """
+        t = citymodel.schedule.time
+        betas = (beta1, beta2, beta3, beta4, beta5, beta6, beta7)
+        key = betas + (citymodel.subsidy,)
+        if self._stale or key != self._key:
+            self.queue = []
+            self.schedule(citymodel, betas, np.arange(len(self.version)), t)
+            self._key = key
+            self._stale = False
+
+        adopted = []
+        while self.queue and self.queue[0][0] <= t:
+            _, version, i = heapq.heappop(self.queue)
+            if version == self.version[i]:
+                adopted.append(i)
+        adopted = np.array(adopted, dtype=np.intp)
+        if len(adopted) == 0:
+            return adopted
+
+        households = self.households
+        households.solar_panels[adopted] = 1
+        self.version[adopted] += 1
+        for i in adopted.tolist():
+            households.agents[i].set_solar_panels(1)
+
+        # Only the neighbors of the new adopters see a different fraction_with_solar
+        affected = self._neighbours_of(adopted)
+        np.add.at(self.solar_neighbours, affected, 1)
+        self.schedule(citymodel, betas, np.unique(affected), t + 1)
+        return adopted
@@ -1,16 +1,179 @@
-from mesa.space import MultiGrid
+import numpy as np
+from neighbors import ragged_arange
+
+# Moore offsets in the order Mesa's grids list neighborhoods (sorted by x, then y)
+MOORE_OFFSETS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+
+class Grid:
+    """
+    A static, non-toroidal grid for the agent-based model, with the cell API of Mesa's MultiGrid.
+
+    Households never move, so the grid is built for lookups rather than updates. Cell
+    occupancy and dwelling type are NumPy arrays indexed by the flat cell x * height + y, and
+    the agents are kept in a CSR (compressed sparse row) layout: the agents of cell c are
+    `cell_agents[cell_start[c]:cell_start[c + 1]]`, in placement order. The Moore neighbors of
+    every occupied cell are laid out the same way, in one row per occupied cell, so
+    `get_cell_list_contents` of a single cell and `get_neighbors` return a slice of a shared
+    object array in O(1) without copying. Apart from the int32/int8 per-cell arrays, memory
+    grows with the number of households, not with the grid area.
+
+    The CSR arrays are built on the first lookup after agents were placed or removed. The
+    returned sequences are shared and must not be modified.
+    """
+
+    torus = False
 
-class Grid(MultiGrid):
-    """A grid for the agent-based model, extending Mesa's MultiGrid."""
-    
     def __init__(self, width, height):
         """Initialize the grid with given width and height."""
-        super().__init__(width, height, torus=False)
         self.width = width
         self.height = height
+        self.occupancy = np.zeros(width * height, dtype=np.int32)  # number of agents per cell
+        self.cell_type = np.zeros(width * height, dtype=np.int8)  # 0: empty, 1: house, 2: apartment(s)
+        self._agents = []  # placed agents, in placement order
+        self._agent_cells = []  # flat cell of every placed agent
+        self._cell_start = None
+        self._cell_agents = None
+        self._neighbour_rows = {}
+
+    @staticmethod
+    def _as_cell_list(cell_list):
+        """Accept a single (x, y) position as well as a list of positions, like Mesa's grids."""
+        if isinstance(cell_list, tuple) and len(cell_list) == 2 and not isinstance(cell_list[0], tuple):
+            return [cell_list]
+        return cell_list
+
+    def out_of_bounds(self, pos):
+        """Whether `pos` lies outside the grid."""
+        x, y = pos
+        return x < 0 or x >= self.width or y < 0 or y >= self.height
+
+    def place_agent(self, agent, pos):
+        """Place `agent` in cell `pos` and set its `pos` (an agent already in `pos` is not added twice)."""
+        x, y = pos
+        if agent.pos is not None and tuple(agent.pos) == (x, y):
+            return
+        cell = x * self.height + y
+        self._agents.append(agent)
+        self._agent_cells.append(cell)
+        self.occupancy[cell] += 1
+        self.cell_type[cell] = getattr(agent, "type", 0)
+        self._invalidate()
+        agent.pos = pos
+
+    def remove_agent(self, agent):
+        """Remove `agent` from its cell."""
+        x, y = agent.pos
+        cell = x * self.height + y
+        k = next(k for k, placed in enumerate(self._agents) if placed is agent)
+        del self._agents[k]
+        del self._agent_cells[k]
+        self.occupancy[cell] -= 1
+        if self.occupancy[cell] == 0:
+            self.cell_type[cell] = 0
+        self._invalidate()
+        agent.pos = None
+
+    def _invalidate(self):
+        """Drop the CSR layouts after a placement change; the next lookup rebuilds them."""
+        self._cell_start = None
+        self._cell_agents = None
+        self._neighbour_rows = {}
+
+    def _cells(self):
+        """The cell -> agents CSR arrays (cell_start, cell_agents), built if needed."""
+        if self._cell_start is None:
+            # Stable sort keeps the placement order within a cell, as MultiGrid's per-cell lists do
+            order = np.argsort(np.asarray(self._agent_cells, dtype=np.int64), kind="stable")
+            self._cell_agents = np.empty(len(order), dtype=object)
+            self._cell_agents[:] = [self._agents[i] for i in order.tolist()]
+            self._cell_start = np.concatenate(([0], np.cumsum(self.occupancy))).astype(np.int32)
+        return self._cell_start, self._cell_agents
+
+    def _neighbours(self, include_center):
+        """
+        CSR arrays (indptr, agents) of the Moore neighbors of every occupied cell, built if needed.
+
+        The row of occupied cell c is the row of its first agent, `cell_start[c]`; the rows of
+        the cell's other agents are empty, so the layout has one row per placed agent.
+        """
+        rows = self._neighbour_rows.get(include_center)
+        if rows is None:
+            cell_start, cell_agents = self._cells()
+            occupied = np.flatnonzero(self.occupancy)
+            x, y = np.divmod(occupied, self.height)
+            counts = np.zeros((len(MOORE_OFFSETS), len(occupied)), dtype=np.intp)
+            starts = np.zeros((len(MOORE_OFFSETS), len(occupied)), dtype=np.intp)
+            for k, (dx, dy) in enumerate(MOORE_OFFSETS):
+                if dx == 0 and dy == 0 and not include_center:
+                    continue
+                nx, ny = x + dx, y + dy
+                valid = (nx >= 0) & (nx < self.width) & (ny >= 0) & (ny < self.height)
+                neighbour_cells = np.where(valid, nx * self.height + ny, 0)
+                counts[k] = np.where(valid, self.occupancy[neighbour_cells], 0)
+                starts[k] = cell_start[neighbour_cells]
+
+            row_length = np.zeros(len(cell_agents), dtype=np.intp)
+            row_length[cell_start[occupied]] = counts.sum(axis=0)
+            indptr = np.concatenate(([0], np.cumsum(row_length)))
+            agents = np.empty(indptr[-1], dtype=object)
+            written = indptr[cell_start[occupied]]
+            for k in range(len(MOORE_OFFSETS)):
+                agents[ragged_arange(written, counts[k])] = cell_agents[ragged_arange(starts[k], counts[k])]
+                written = written + counts[k]
+            rows = self._neighbour_rows[include_center] = (indptr, agents)
+        return rows
+
+    def is_cell_empty(self, pos):
+        """Whether no agent occupies cell `pos`."""
+        x, y = pos
+        return self.occupancy[x * self.height + y] == 0
+
+    def iter_cell_list_contents(self, cell_list):
+        """Iterate over the agents of all cells in `cell_list`."""
+        cell_start, cell_agents = self._cells()
+        for x, y in self._as_cell_list(cell_list):
+            cell = x * self.height + y
+            yield from cell_agents[cell_start[cell]:cell_start[cell + 1]]
+
+    def get_cell_list_contents(self, cell_list):
+        """Agents of all cells in `cell_list`; a shared slice of the cell's agents if `cell_list` is a single cell."""
+        cell_list = self._as_cell_list(cell_list)
+        if len(cell_list) == 1:
+            cell_start, cell_agents = self._cells()
+            x, y = cell_list[0]
+            cell = x * self.height + y
+            return cell_agents[cell_start[cell]:cell_start[cell + 1]]
+        return list(self.iter_cell_list_contents(cell_list))
+
+    def get_neighborhood(self, pos, moore=True, include_center=False, radius=1):
+        """Positions of the cells around `pos` within `radius` (Moore or von Neumann), clipped to the grid."""
+        x, y = pos
+        neighborhood = []
+        for dx in range(-radius, radius + 1):
+            for dy in range(-radius, radius + 1):
+                if not moore and abs(dx) + abs(dy) > radius:
+                    continue
+                if dx == 0 and dy == 0 and not include_center:
+                    continue
+                if 0 <= x + dx < self.width and 0 <= y + dy < self.height:
+                    neighborhood.append((x + dx, y + dy))
+        return neighborhood
 
     def get_neighbors(self, pos, include_center=False):
         """Get neighbors of a given position moore neighborhood."""
-        return super().get_neighbors(pos, include_center=include_center, moore=True)
-    
-    
+        x, y = pos
+        cell = x * self.height + y
+        if self.occupancy[cell] == 0:
+            # Only occupied cells have a row; the neighbors of an empty cell are gathered on demand
+            return self.get_cell_list_contents(self.get_neighborhood(pos, True, include_center))
+        cell_start, _ = self._cells()
+        indptr, agents = self._neighbours(include_center)
+        row = cell_start[cell]
+        return agents[indptr[row]:indptr[row + 1]]
+
+    def coord_iter(self):
+        """Iterate over (cell contents, x, y) of every cell, as Mesa's grids do."""
+        for x in range(self.width):
+            for y in range(self.height):
+                yield self.get_cell_list_contents([(x, y)]), x, y
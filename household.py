@@ -1,13 +1,49 @@
 #class for household agent
-from mesa import Agent
+from functools import lru_cache
 import numpy as np
 from scipy.stats import norm
 
-class Household(Agent):
-    """A household agent with unique id and position in the grid"""
-    
+ADOPTION_THRESHOLD = 0.98 # adoption probability a household must exceed to install solar panels
+CUTOFF_MARGIN = 1e-9 # utilities this close to the cutoff are recomputed in the original summation order
+
+
+def utility_cutoff(threshold=ADOPTION_THRESHOLD):
+    """Smallest utility u for which norm.cdf(u) > threshold, so the probit test needs no CDF call"""
+    cutoff = norm.ppf(threshold)
+    # ppf and cdf round independently: walk to the exact floating point boundary
+    while norm.cdf(cutoff) > threshold:
+        cutoff = np.nextafter(cutoff, -np.inf)
+    while not norm.cdf(cutoff) > threshold:
+        cutoff = np.nextafter(cutoff, np.inf)
+    return cutoff
+
+
+UTILITY_CUTOFF = utility_cutoff()
+
+
+@lru_cache(maxsize=16)
+def static_key(beta1, beta2, beta4, beta5, beta6, beta7, subsidy):
+    """Key of the cached static utility terms; one tuple is shared by all households instead of one each"""
+    return (beta1, beta2, beta4, beta5, beta6, beta7, subsidy)
+
+
+class Household:
+    """
+    A household agent with unique id and position in the grid.
+
+    Households have the attributes of a Mesa `Agent` (`unique_id`, `model`, `pos`) but
+    declare `__slots__` instead of inheriting a per-instance `__dict__`, which keeps
+    cities with millions of households in memory.
+    """
+
+    __slots__ = ("unique_id", "model", "pos", "income", "stubborness_factor", "environmental_consciousness",
+                 "education_level", "type", "solar_panels", "subsidy", "future_awareness", "num_neighbours",
+                 "solar_neighbours", "_static_utility", "_static_key")
+
     def __init__(self, unique_id, model):
-        super().__init__(unique_id, model)
+        self.unique_id = unique_id
+        self.model = model
+        self.pos = None
         self.income = 0 # 1: low income, 2: mid income, 3: high income
         self.stubborness_factor = 0
         self.environmental_consciousness = 0
@@ -15,31 +51,43 @@ class Household(Agent):
         self.type = 0 # 1: house, 2:apartment
         self.solar_panels = 0 # 0: no solar panels, 1: solar panels installed
         self.subsidy = 0 # 0: no subsidy, 1: subsidy received
+        self.num_neighbours = 0 # size of the (static) Moore neighborhood
+        self.solar_neighbours = 0 # number of neighbors with solar panels, kept up to date by the model
+        self._static_utility = None # cached utility terms that do not depend on the neighbors or the noise
+        self._static_key = None # betas and model subsidy flag the cached terms were computed with
 
     def set_income(self, income):
         """Set the income of the household"""
         self.income = income
+        self._static_utility = None
     def set_stubborness_factor(self, factor):
         """Set the stubbornness factor of the household"""
         self.stubborness_factor = factor
+        self._static_utility = None
     def set_environmental_consciousness(self, consciousness):
         """Set the environmental consciousness of the household"""
         self.environmental_consciousness = consciousness
+        self._static_utility = None
     def set_type(self, apt_type):
         """Set the type of the household"""
         self.type = apt_type
+        self._static_utility = None
     def set_future_awareness(self, awareness):
         """Set the future awareness of the household"""
         self.future_awareness = awareness
     def set_education_level(self, level):
         """Set the education level of the household"""
         self.education_level = level
+        self._static_utility = None
     def set_solar_panels(self, solar_panels):
-        """Set the solar panels of the household"""
+        """Set the solar panels of the household and let the model update the neighbors' counters on adoption"""
+        if solar_panels == 1 and self.solar_panels == 0:
+            self.model.record_adoption(self)
         self.solar_panels = solar_panels
     def set_subsidy(self, subsidy):
         """Set the subsidy of the household"""
         self.subsidy = subsidy
+        self._static_utility = None
     def get_neighbours(self, grid):
         """Get the neighbors of the household in the grid"""
         if self.type == 2:
@@ -47,26 +95,40 @@ class Household(Agent):
         else:
             include_center = False
         return grid.get_neighbors(self.pos, include_center)
+    def fraction_with_solar(self):
+        """Fraction of the neighbors that have solar panels"""
+        return self.solar_neighbours / self.num_neighbours if self.num_neighbours else 0
     
-    def utility(self, grid, citymodel, beta1, beta2, beta3, beta4, beta5, beta6, beta7):
-        """Calculate the utility of the household based on all of its attributes"""
-        neighbours = self.get_neighbours(grid)
-        solar_neighbors = [n for n in neighbours if n.solar_panels == 1]
-        fraction_with_solar = len(solar_neighbors) / len(neighbours) if neighbours else 0
+    def static_utility(self, citymodel, beta1, beta2, beta4, beta5, beta6, beta7):
+        """Utility terms that stay fixed between subsidy or beta changes, cached per household"""
+        key = static_key(beta1, beta2, beta4, beta5, beta6, beta7, citymodel.subsidy)
+        if self._static_utility is None or key is not self._static_key:
+            self._static_utility = beta1 * (self.income / 3) + beta2 * self.environmental_consciousness - beta4 * self.stubborness_factor + beta5 * (self.education_level/3) + beta6 * self.subsidy * citymodel.subsidy + beta7 * (1 - self.type)
+            self._static_key = key
+        return self._static_utility
 
-        noise = np.random.normal(0, 0.5) # Creating noise from a normal distribution
+    def _utility(self, citymodel, beta1, beta2, beta3, beta4, beta5, beta6, beta7, fraction_with_solar, noise):
+        """Utility for a given neighbor fraction and noise draw"""
+        return beta1 * (self.income / 3) + beta2 * self.environmental_consciousness  + beta3 * fraction_with_solar - beta4 * self.stubborness_factor + beta5 * (self.education_level/3) + beta6 * self.subsidy * citymodel.subsidy + beta7 * (1 - self.type) + noise
 
-        utility = beta1 * (self.income / 3) + beta2 * self.environmental_consciousness  + beta3 * fraction_with_solar - beta4 * self.stubborness_factor + beta5 * (self.education_level/3) + beta6 * self.subsidy * citymodel.subsidy + beta7 * (1 - self.type) + noise
-        return utility
+    def utility(self, grid, citymodel, beta1, beta2, beta3, beta4, beta5, beta6, beta7):
+        """Calculate the utility of the household based on all of its attributes"""
+        noise = citymodel.rng.normal(0, 0.5) # Creating noise from a normal distribution
+        return self._utility(citymodel, beta1, beta2, beta3, beta4, beta5, beta6, beta7, self.fraction_with_solar(), noise)
     
-    def step(self, grid, citymodel, beta1, beta2, beta3, beta4, beta5, beta6, beta7):
-        """Define the step function for the household agent"""
+    def step(self, grid, citymodel, beta1, beta2, beta3, beta4, beta5, beta6, beta7, noise=None):
+        """Define the step function for the household agent, optionally with this step's noise drawn by the model"""
         if self.solar_panels == 1:
             return
-        # Probit model for solar panel installation
-        utility = self.utility(grid, citymodel, beta1, beta2, beta3, beta4, beta5, beta6, beta7)
-        prob_installation = norm.cdf(utility)
-        if 0.98 < prob_installation:
-            self.solar_panels = 1
+        # Probit model for solar panel installation: norm.cdf(utility) > 0.98 exactly when utility >= UTILITY_CUTOFF
+        fraction_with_solar = self.fraction_with_solar()
+        if noise is None:
+            noise = citymodel.rng.normal(0, 0.5) # Creating noise from a normal distribution
+        utility = self.static_utility(citymodel, beta1, beta2, beta4, beta5, beta6, beta7) + beta3 * fraction_with_solar + noise
+        if abs(utility - UTILITY_CUTOFF) < CUTOFF_MARGIN:
+            # Summing in a different order can move the utility by a few ulps, so recompute it exactly
+            utility = self._utility(citymodel, beta1, beta2, beta3, beta4, beta5, beta6, beta7, fraction_with_solar, noise)
+        if utility >= UTILITY_CUTOFF:
+            self.set_solar_panels(1)
 
 
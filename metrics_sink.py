@@ -0,0 +1,126 @@
+import glob
+import os
+import numpy as np
+import pandas as pd
+
+CHUNK_PATTERN = "chunk_{:06d}.npz"
+# Chunks are written under a hidden name first, so the chunk glob never matches a partial file
+TEMPORARY_PATTERN = ".chunk_{:06d}.tmp"
+
+
+def chunk_files(directory):
+    """Chunk files of a metrics directory, in writing order."""
+    return sorted(glob.glob(os.path.join(directory, "chunk_*.npz")))
+
+
+def read_metrics(directory):
+    """
+    Read the metrics streamed to `directory` by a `MetricsSink`.
+
+    Only complete chunks are read, so this can be called while the run is still writing.
+
+    Args:
+        directory (str): Directory of the sink.
+
+    Returns:
+        pandas.DataFrame: One row per collected step, indexed by the step it was collected after.
+    """
+    frames = []
+    for path in chunk_files(directory):
+        with np.load(path) as chunk:
+            columns = chunk["columns"].tolist()
+            frames.append(pd.DataFrame({name: chunk[f"column_{k}"] for k, name in enumerate(columns)},
+                                       index=pd.Index(chunk["step"], name="Step")))
+    if not frames:
+        return pd.DataFrame(index=pd.Index([], name="Step"))
+    return pd.concat(frames)
+
+
+class MetricsSink:
+    """
+    Columnar on-disk store of the model reporters, written while the model runs.
+
+    Rows are buffered and written as numbered npz chunks of `chunk_rows` rows, one array per
+    reporter, so memory stays bounded by one chunk however long the run is. Chunks are written
+    to a temporary file and renamed, so `read_metrics` never sees a partial chunk.
+    """
+
+    def __init__(self, directory, chunk_rows=100, append=False):
+        """
+        Args:
+            directory (str): Directory the chunks are written to (created if needed).
+            chunk_rows (int): Number of rows per chunk.
+            append (bool): Keep the chunks already in `directory` (e.g. to resume a run)
+                instead of removing them.
+        """
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        os.makedirs(directory, exist_ok=True)
+        if not append:
+            for path in chunk_files(directory):
+                os.remove(path)
+        self.num_chunks = len(chunk_files(directory))
+        self.columns = None
+        self.steps = []
+        self.rows = []
+
+    def write(self, step, values):
+        """
+        Append the reporter values collected after `step`.
+
+        Args:
+            step (int): Step the values were collected after.
+            values (dict): Reporter name to value.
+        """
+        if self.columns is None:
+            self.columns = list(values)
+        self.steps.append(step)
+        self.rows.append([values[name] for name in self.columns])
+        if len(self.rows) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows as a new chunk."""
+        if not self.rows:
+            return
+        arrays = {f"column_{k}": np.asarray(column) for k, column in enumerate(zip(*self.rows))}
+        self.write_chunk(self.num_chunks, step=np.asarray(self.steps), columns=np.asarray(self.columns), **arrays)
+        self.num_chunks += 1
+        self.steps = []
+        self.rows = []
+
+    def write_chunk(self, number, **arrays):
+        """Write chunk `number` atomically: to a temporary file first, then renamed over the chunk."""
+        temporary = os.path.join(self.directory, TEMPORARY_PATTERN.format(number))
+        with open(temporary, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(temporary, os.path.join(self.directory, CHUNK_PATTERN.format(number)))
+
+    def truncate(self, step):
+        """
+        Drop the rows collected after `step`, e.g. the ones written after the checkpoint a run resumes from.
+
+        The chunk holding `step` is replaced by its kept rows before any later chunk is removed, so
+        an interruption never loses rows up to `step`.
+
+        Args:
+            step (int): Last step to keep.
+        """
+        self.flush()
+        paths = chunk_files(self.directory)
+        num_kept = 0
+        for number, path in enumerate(paths):
+            with np.load(path) as chunk:
+                arrays = dict(chunk)
+            keep = arrays["step"] <= step
+            if keep.all():
+                num_kept += 1
+                continue
+            if keep.any():
+                self.write_chunk(number, **{name: array if name == "columns" else array[keep]
+                                            for name, array in arrays.items()})
+                num_kept += 1
+            break
+        for path in paths[num_kept:]:
+            os.remove(path)
+        self.num_chunks = num_kept
@@ -0,0 +1,90 @@
+import numpy as np
+
+
+def ragged_arange(starts, lengths):
+    """Concatenate `arange(start, start + length)` for every start/length pair without a Python loop."""
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.intp)
+    group_starts = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+    return group_starts + np.arange(total)
+
+
+class NeighborIndex:
+    """
+    Static CSR (compressed sparse row) index of every household's Moore neighbors.
+
+    Households never move, so the neighbors returned by `Household.get_neighbours` are
+    computed once: the neighbors of agent i are `indices[indptr[i]:indptr[i + 1]]`.
+    Apartments include every household of their own cell (themselves too), houses only the
+    surrounding cells. The relation is symmetric, so the same lists also tell which agents
+    are influenced when agent i adopts. Neighbor ids are stored as int32 to keep the index
+    small for very large cities.
+    """
+
+    def __init__(self, x, y, types, width, height):
+        """
+        Build the index from the agents' positions.
+
+        Args:
+            x (numpy.ndarray): x coordinate of every agent, indexed by unique_id.
+            y (numpy.ndarray): y coordinate of every agent, indexed by unique_id.
+            types (numpy.ndarray): Dwelling type of every agent (1: house, 2: apartment).
+            width (int): Width of the grid.
+            height (int): Height of the grid.
+        """
+        x = np.asarray(x, dtype=np.intp)
+        y = np.asarray(y, dtype=np.intp)
+        apartments = np.asarray(types) == 2
+
+        # Agents grouped by cell: the agents of cell c are by_cell[cell_start[c]:cell_start[c + 1]]
+        cells = x * height + y
+        by_cell = np.argsort(cells, kind="stable")
+        cell_count = np.bincount(cells, minlength=width * height)
+        cell_start = np.concatenate(([0], np.cumsum(cell_count)))
+
+        offsets = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+        counts = np.zeros((len(offsets), len(x)), dtype=np.intp)
+        neighbour_cells = np.zeros((len(offsets), len(x)), dtype=np.intp)
+        for k, (dx, dy) in enumerate(offsets):
+            nx, ny = x + dx, y + dy
+            valid = (nx >= 0) & (nx < width) & (ny >= 0) & (ny < height)
+            if dx == 0 and dy == 0:
+                valid &= apartments
+            neighbour_cells[k] = np.where(valid, nx * height + ny, 0)
+            counts[k] = np.where(valid, cell_count[neighbour_cells[k]], 0)
+
+        degree = counts.sum(axis=0)
+        self.indptr = np.concatenate(([0], np.cumsum(degree)))
+        self.indices = np.zeros(self.indptr[-1], dtype=np.int32)
+        written = self.indptr[:-1].copy()
+        for k in range(len(offsets)):
+            source = ragged_arange(cell_start[neighbour_cells[k]], counts[k])
+            target = ragged_arange(written, counts[k])
+            self.indices[target] = by_cell[source]
+            written += counts[k]
+
+    @classmethod
+    def from_csr(cls, indptr, indices):
+        """Rebuild an index from the `indptr` and `indices` arrays of another one (e.g. loaded from a snapshot)."""
+        index = cls.__new__(cls)
+        index.indptr = np.asarray(indptr, dtype=np.intp)
+        index.indices = np.asarray(indices, dtype=np.int32)
+        return index
+
+    @classmethod
+    def from_agents(cls, agents, width, height):
+        """Build the index from placed household agents whose unique_ids run from 0 to len(agents) - 1."""
+        agents = sorted(agents, key=lambda a: a.unique_id)
+        x = [a.pos[0] for a in agents]
+        y = [a.pos[1] for a in agents]
+        types = [a.type for a in agents]
+        return cls(x, y, types, width, height)
+
+    def degree(self):
+        """Number of neighbors of every agent."""
+        return np.diff(self.indptr)
+
+    def neighbours_of(self, i):
+        """List of the unique_ids of the neighbors of agent i."""
+        return self.indices[self.indptr[i]:self.indptr[i + 1]].tolist()
@@ -0,0 +1,324 @@
+import hashlib
+import os
+import numpy as np
+from neighbors import NeighborIndex
+from rng import as_seed_sequence, child_seed, numpy_generator, PLACEMENT_STREAM
+
+# 11 neighborhoods with different income distributions and spatial geometry (some of them overlap)
+NEIGHBORHOODS = [
+    {"x_range": (0, 84), "y_range": (0, 64), "income_dist": [1, 2, 3], "weights": [0.85, 0.15, 0.0]},
+    {"x_range": (84, 120), "y_range": (66, 120), "income_dist": [1, 2, 3], "weights": [0.6, 0.39, 0.01]},
+    {"x_range": (0, 39), "y_range": (38, 64), "income_dist": [1, 2, 3], "weights": [0.75, 0.25, 0.0]},
+    {"x_range": (39, 51), "y_range": (46, 64), "income_dist": [2, 3, 1], "weights": [0.7, 0.2, 0.1]},
+    {"x_range": (39, 51), "y_range": (38, 46), "income_dist": [2, 1, 3], "weights": [0.7, 0.2, 0.1]},
+    {"x_range": (51, 57), "y_range": (38, 42), "income_dist": [2, 3, 1], "weights": [0.7, 0.2, 0.1]},
+    {"x_range": (51, 94), "y_range": (42, 64), "income_dist": [3, 2, 1], "weights": [0.7, 0.3, 0.0]},
+    {"x_range": (94, 120), "y_range": (42, 66), "income_dist": [2, 1, 3], "weights": [0.7, 0.1, 0.2]},
+    {"x_range": (57, 120), "y_range": (0, 42), "income_dist": [3, 2, 1], "weights": [0.7, 0.3, 0.0]},
+    {"x_range": (0, 84), "y_range": (64, 66), "income_dist": [3, 2, 1], "weights": [0.7, 0.3, 0.0]},
+    {"x_range": (0, 84), "y_range": (64, 120), "income_dist": [2, 3, 1], "weights": [0.7, 0.2, 0.1]}
+]
+
+# Education level (1, 2, 3) and housing type (1: house, 2: apartment) probabilities per income level
+EDUCATION_WEIGHTS = {1: [0.1, 0.6, 0.3], 2: [0.05, 0.2, 0.75], 3: [0.01, 0.1, 0.89]}
+TYPE_WEIGHTS = {1: [0.2, 0.8], 2: [0.5, 0.5], 3: [0.8, 0.2]}
+
+
+class Population:
+    """
+    Traits and grid positions of a generated city's households, one array entry per household.
+
+    A population only depends on the generation parameters and the seed, not on the betas or
+    the subsidy, so it can be built once and shared by every model simulating the same city
+    (see `CityModel`'s `population` argument), in memory or through an npz snapshot.
+    """
+
+    def __init__(self, income, education_level, type, environmental_consciousness, stubborness_factor, x, y,
+                 width, height):
+        """
+        Args:
+            income (numpy.ndarray): Income level of every household (1: low, 2: mid, 3: high).
+            education_level (numpy.ndarray): Education level of every household (1, 2 or 3).
+            type (numpy.ndarray): Housing type of every household (1: house, 2: apartment).
+            environmental_consciousness (numpy.ndarray): Environmental consciousness in [0, 1].
+            stubborness_factor (numpy.ndarray): Stubbornness in [0, 1].
+            x (numpy.ndarray): x coordinate of every household.
+            y (numpy.ndarray): y coordinate of every household.
+            width (int): Width of the grid.
+            height (int): Height of the grid.
+        """
+        self.income = np.asarray(income, dtype=np.int8)
+        self.education_level = np.asarray(education_level, dtype=np.int8)
+        self.type = np.asarray(type, dtype=np.int8)
+        self.environmental_consciousness = np.asarray(environmental_consciousness, dtype=float)
+        self.stubborness_factor = np.asarray(stubborness_factor, dtype=float)
+        self.x = np.asarray(x, dtype=np.int32)
+        self.y = np.asarray(y, dtype=np.int32)
+        self.width = width
+        self.height = height
+        self._neighbours = None
+
+    def __len__(self):
+        return len(self.income)
+
+    @property
+    def neighbours(self):
+        """Static neighbor index of the households, built on first use and shared by all models of this city."""
+        if self._neighbours is None:
+            self._neighbours = NeighborIndex(self.x, self.y, self.type, self.width, self.height)
+        return self._neighbours
+
+    def to_arrays(self):
+        """The population and its neighbor index as a dict of arrays, e.g. to store in an npz file."""
+        return {"income": self.income, "education_level": self.education_level, "type": self.type,
+                "environmental_consciousness": self.environmental_consciousness,
+                "stubborness_factor": self.stubborness_factor, "x": self.x, "y": self.y,
+                "shape": np.array([self.width, self.height]),
+                "indptr": self.neighbours.indptr, "indices": self.neighbours.indices}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuild a population from the arrays returned by `to_arrays`."""
+        width, height = np.asarray(arrays["shape"]).tolist()
+        population = cls(arrays["income"], arrays["education_level"], arrays["type"],
+                         arrays["environmental_consciousness"], arrays["stubborness_factor"],
+                         arrays["x"], arrays["y"], width, height)
+        population._neighbours = NeighborIndex.from_csr(arrays["indptr"], arrays["indices"])
+        return population
+
+    def save(self, path):
+        """Write the population and its neighbor index to the npz snapshot `path`."""
+        np.savez_compressed(path, **self.to_arrays())
+
+    @classmethod
+    def load(cls, path):
+        """Read a population written by `save`."""
+        with np.load(path) as snapshot:
+            return cls.from_arrays(snapshot)
+
+
+class _CellPools:
+    """
+    Cells still available to new households, per neighborhood.
+
+    For every neighborhood two pools are kept: empty cells (usable by houses and apartments)
+    and apartment-only cells (usable by apartments). Pools are int32 arrays with a fill count,
+    and every empty-cell pool has a position map indexed by the cell's offset within the
+    neighborhood, so that a cell can be drawn and removed in O(1) without rejection sampling.
+    The neighborhoods of every cell are a CSR (compressed sparse row) mapping, so memory grows
+    with the area of the neighborhoods rather than with cells times neighborhoods.
+    """
+
+    def __init__(self, areas, width, height):
+        """
+        Args:
+            areas (list): (x_min, x_max, y_min, y_max) of every neighborhood, clipped to the grid.
+            width (int): Width of the grid.
+            height (int): Height of the grid.
+        """
+        self.areas = areas
+        self.height = height
+        self.free = []
+        self.free_size = []
+        self.free_where = []
+        self.apartments = []
+        self.apartment_size = []
+        members = []
+        for x_min, x_max, y_min, y_max in areas:
+            xs, ys = np.meshgrid(np.arange(x_min, x_max), np.arange(y_min, y_max), indexing="ij")
+            cells = (xs * height + ys).ravel().astype(np.int32)
+            # Cells start in offset order, so the position of every cell is its offset
+            self.free.append(cells.copy())
+            self.free_size.append(len(cells))
+            self.free_where.append(np.arange(len(cells), dtype=np.int32))
+            self.apartments.append(np.zeros(len(cells), dtype=np.int32))
+            self.apartment_size.append(0)
+            members.append(cells)
+
+        # Neighborhoods of cell c, in neighborhood order: area_index[area_start[c]:area_start[c + 1]]
+        cells = np.concatenate(members)
+        owners = np.repeat(np.arange(len(areas), dtype=np.int32), [len(m) for m in members])
+        self.area_index = owners[np.argsort(cells, kind="stable")]
+        self.area_start = np.concatenate(([0], np.cumsum(np.bincount(cells, minlength=width * height)))).astype(np.int32)
+
+    def has_room(self, area):
+        """Whether neighborhood `area` has an empty or apartment cell left."""
+        return self.free_size[area] > 0 or self.apartment_size[area] > 0
+
+    def _cell_areas(self, cell):
+        """Neighborhoods containing `cell`."""
+        return self.area_index[self.area_start[cell]:self.area_start[cell + 1]].tolist()
+
+    def _offset(self, area, cell):
+        """Offset of `cell` within the rectangle of neighborhood `area`."""
+        x_min, _, y_min, y_max = self.areas[area]
+        x, y = divmod(cell, self.height)
+        return (x - x_min) * (y_max - y_min) + y - y_min
+
+    def _remove(self, area, cell):
+        """Swap-remove `cell` from the empty-cell pool of neighborhood `area`."""
+        free, where = self.free[area], self.free_where[area]
+        position = where[self._offset(area, cell)]
+        size = self.free_size[area] - 1
+        last = int(free[size])
+        free[position] = last
+        where[self._offset(area, last)] = position
+        self.free_size[area] = size
+
+    def _take(self, cell):
+        """Remove `cell` from the empty-cell pools of all its neighborhoods; returns those neighborhoods."""
+        areas = self._cell_areas(cell)
+        for k in areas:
+            self._remove(k, cell)
+        return areas
+
+    def place_house(self, area, draw):
+        """Take the empty cell of neighborhood `area` selected by the uniform `draw`, or None if there is none."""
+        size = self.free_size[area]
+        if not size:
+            return None
+        cell = int(self.free[area][int(draw * size)])
+        self._take(cell)
+        return cell
+
+    def place_apartment(self, area, draw):
+        """Take the empty or apartment cell of neighborhood `area` selected by the uniform `draw`, or None."""
+        free_size, apartment_size = self.free_size[area], self.apartment_size[area]
+        choice = int(draw * (free_size + apartment_size))
+        if choice >= free_size:
+            return int(self.apartments[area][choice - free_size]) if apartment_size else None
+        cell = int(self.free[area][choice])
+        for k in self._take(cell):
+            self.apartments[k][self.apartment_size[k]] = cell
+            self.apartment_size[k] += 1
+        return cell
+
+
+def _sample_traits(rng, n, neighborhoods, area_weights, flag_random):
+    """Draw neighborhood, income, education, housing type and behavioral traits of n households at once."""
+    consciousness = rng.uniform(0, 1, n)
+    stubbornness = rng.uniform(0, 1, n)
+    if flag_random:
+        area = np.zeros(n, dtype=np.intp)
+        income = rng.integers(1, 4, n)
+        education = rng.integers(1, 4, n)
+        agent_type = rng.integers(1, 3, n)
+        return area, income, education, agent_type, consciousness, stubbornness
+
+    area = rng.choice(len(neighborhoods), size=n, p=area_weights)
+    income = np.zeros(n, dtype=np.int8)
+    for k, neighborhood in enumerate(neighborhoods):
+        members = np.flatnonzero(area == k)
+        weights = np.asarray(neighborhood["weights"]) / np.sum(neighborhood["weights"])
+        income[members] = rng.choice(neighborhood["income_dist"], size=len(members), p=weights)
+    education = np.zeros(n, dtype=np.int8)
+    agent_type = np.zeros(n, dtype=np.int8)
+    for level in (1, 2, 3):
+        members = np.flatnonzero(income == level)
+        education[members] = rng.choice([1, 2, 3], size=len(members), p=EDUCATION_WEIGHTS[level])
+        agent_type[members] = rng.choice([1, 2], size=len(members), p=TYPE_WEIGHTS[level])
+    return area, income, education, agent_type, consciousness, stubbornness
+
+
+def generate_population(width, height, num_agents, flag_random, rng):
+    """
+    Generate the households of a city without rejection sampling.
+
+    Traits are drawn for all households at once. With `flag_random` 0 every household picks
+    one of the 11 neighborhoods (weighted by area) and gets its income from that neighborhood's
+    distribution, and education and housing type from its income; with `flag_random` 1 all
+    of them are uniform over the whole grid. Houses then take a uniformly drawn empty cell of
+    their neighborhood, and apartments a uniformly drawn cell that is empty or only holds
+    apartments. A household whose neighborhood has no suitable cell left is redrawn.
+
+    Args:
+        width (int): Width of the grid.
+        height (int): Height of the grid.
+        num_agents (int): Number of households.
+        flag_random (int): Random placement over the whole grid (1) or the 11 neighborhoods (0).
+        rng (numpy.random.Generator): Random stream of the city generation.
+
+    Returns:
+        Population: The generated households, in placement order.
+    """
+    if flag_random:
+        neighborhoods = [{"x_range": (0, width), "y_range": (0, height)}]
+    else:
+        neighborhoods = NEIGHBORHOODS
+    areas = []
+    for n in neighborhoods:
+        x_min, x_max = n["x_range"]
+        y_min, y_max = n["y_range"]
+        areas.append((min(x_min, width), min(x_max, width), min(y_min, height), min(y_max, height)))
+    area_sizes = np.array([(x_max - x_min) * (y_max - y_min) for x_min, x_max, y_min, y_max in areas], dtype=float)
+    if area_sizes.sum() == 0:
+        raise ValueError(f"No neighborhood lies within a {width}x{height} grid.")
+    area_weights = area_sizes / area_sizes.sum()
+
+    pools = _CellPools(areas, width, height)
+    placed = {name: [] for name in ("income", "education", "type", "consciousness", "stubbornness", "cell")}
+    while len(placed["cell"]) < num_agents:
+        missing = num_agents - len(placed["cell"])
+        area, income, education, agent_type, consciousness, stubbornness = _sample_traits(
+            rng, missing, neighborhoods, area_weights, flag_random)
+        draws = rng.random(missing).tolist()
+        traits = zip(area.tolist(), income.tolist(), education.tolist(), agent_type.tolist(),
+                     consciousness.tolist(), stubbornness.tolist(), draws)
+        for k, level, education_level, kind, consciousness_level, stubbornness_level, draw in traits:
+            cell = pools.place_house(k, draw) if kind == 1 else pools.place_apartment(k, draw)
+            if cell is None:
+                continue  # no room left for this household in its neighborhood: it is redrawn
+            placed["cell"].append(cell)
+            placed["income"].append(level)
+            placed["education"].append(education_level)
+            placed["type"].append(kind)
+            placed["consciousness"].append(consciousness_level)
+            placed["stubbornness"].append(stubbornness_level)
+        # Apartments fit in any empty or apartment cell, so the city is full only when no such cell is left
+        if not any(pools.has_room(k) for k in np.flatnonzero(area_weights > 0).tolist()):
+            if len(placed["cell"]) < num_agents:
+                raise ValueError(f"Cannot place {num_agents} households on a {width}x{height} grid.")
+
+    cells = np.array(placed["cell"], dtype=np.int64)
+    return Population(placed["income"], placed["education"], placed["type"], placed["consciousness"],
+                      placed["stubbornness"], cells // height, cells % height, width, height)
+
+
+def build_population(width, height, num_agents, flag_random, seed):
+    """
+    Generate the city a `CityModel` with these parameters and `seed` would generate.
+
+    Args:
+        width (int): Width of the grid.
+        height (int): Height of the grid.
+        num_agents (int): Number of households.
+        flag_random (int): Random placement over the whole grid (1) or the 11 neighborhoods (0).
+        seed (None | int | numpy.random.SeedSequence): Model seed; the city uses its placement stream.
+
+    Returns:
+        Population: The generated households.
+    """
+    rng = numpy_generator(child_seed(seed, PLACEMENT_STREAM))
+    return generate_population(width, height, num_agents, flag_random, rng)
+
+
+def snapshot_path(directory, width, height, num_agents, flag_random, seed):
+    """
+    File name of the snapshot of a city, keyed by its generation parameters and seed.
+
+    Args:
+        directory (str): Directory holding the snapshots.
+        width (int): Width of the grid.
+        height (int): Height of the grid.
+        num_agents (int): Number of households.
+        flag_random (int): Random placement over the whole grid (1) or the 11 neighborhoods (0).
+        seed (int | numpy.random.SeedSequence): Model seed.
+
+    Returns:
+        str: Path of the npz snapshot.
+    """
+    seed = as_seed_sequence(seed)
+    key = repr((seed.entropy, tuple(seed.spawn_key), seed.pool_size)).encode()
+    digest = hashlib.sha256(key).hexdigest()[:16]
+    return os.path.join(directory, f"city_{width}x{height}_{num_agents}_{flag_random}_{digest}.npz")
+
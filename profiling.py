@@ -0,0 +1,107 @@
+import time
+import pandas as pd
+
+
+class _Phase:
+    """Context manager adding the time spent in its block to one phase of a `PhaseTimer`."""
+
+    __slots__ = ("timer", "name", "start")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class PhaseTimer:
+    """
+    Accumulated wall-clock time and call count of named phases of a run.
+
+    Phases may be nested (e.g. "adoption/neighbour counters" inside "step/dynamics"); the time of a
+    nested phase is also part of the time of its enclosing phase.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.totals = {}
+        self.calls = {}
+
+    def phase(self, name):
+        """Context manager timing one call of phase `name`."""
+        return _Phase(self, name)
+
+    def add(self, name, seconds):
+        """Add one call of `seconds` to phase `name`."""
+        self.totals[name] = self.totals.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def wrap(self, name, function):
+        """`function`, timed as phase `name` every time it is called."""
+        def timed(*args, **kwargs):
+            with self.phase(name):
+                return function(*args, **kwargs)
+        return timed
+
+    def reset(self):
+        """Forget all timings, e.g. to exclude the initialization from a profile."""
+        self.totals.clear()
+        self.calls.clear()
+
+    def summary(self):
+        """
+        Timings of all phases.
+
+        Returns:
+            pandas.DataFrame: Total seconds, number of calls and mean seconds per call of every phase,
+                slowest first.
+        """
+        df = pd.DataFrame({"total_s": pd.Series(self.totals, dtype=float),
+                           "calls": pd.Series(self.calls, dtype=int)})
+        df.index.name = "phase"
+        df["mean_s"] = df["total_s"] / df["calls"]
+        return df.sort_values("total_s", ascending=False)
+
+
+class _NullPhase:
+    """Context manager that does nothing."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullTimer:
+    """Drop-in `PhaseTimer` used when profiling is disabled: every call is a no-op."""
+
+    enabled = False
+    _phase = _NullPhase()
+
+    def phase(self, name):
+        return self._phase
+
+    def add(self, name, seconds):
+        pass
+
+    def wrap(self, name, function):
+        return function
+
+    def reset(self):
+        pass
+
+    def summary(self):
+        return PhaseTimer().summary()
+
+
+NULL_TIMER = NullTimer()
@@ -0,0 +1,77 @@
+import numpy as np
+
+
+def box_sum(raster):
+    """Sum every cell of a 2D raster with its Moore neighborhood (3x3 window, no wrap-around)."""
+    padded = np.pad(raster, 1)
+    width, height = raster.shape
+    total = np.zeros_like(raster)
+    for dx in range(3):
+        for dy in range(3):
+            total += padded[dx:dx + width, dy:dy + height]
+    return total
+
+
+class CellRasters:
+    """
+    Per-cell household counts of the grid, kept up to date as households adopt.
+
+    `occupants` and `adopters` hold the number of households and of households with solar
+    panels in every cell, and `houses` marks the cells occupied by a house (a house never
+    shares its cell). Spatial metrics and the array engine read these rasters instead of
+    walking the agents.
+    """
+
+    def __init__(self, x, y, types, solar_panels, width, height):
+        """
+        Args:
+            x (numpy.ndarray): x coordinate of every household.
+            y (numpy.ndarray): y coordinate of every household.
+            types (numpy.ndarray): Dwelling type of every household (1: house, 2: apartment).
+            solar_panels (numpy.ndarray): Adoption state of every household (0 or 1).
+            width (int): Width of the grid.
+            height (int): Height of the grid.
+        """
+        x = np.asarray(x, dtype=np.intp)
+        y = np.asarray(y, dtype=np.intp)
+        self.width = width
+        self.height = height
+        self.occupants = np.zeros((width, height), dtype=np.int32)
+        np.add.at(self.occupants, (x, y), 1)
+        self.adopters = np.zeros((width, height), dtype=np.int32)
+        np.add.at(self.adopters, (x, y), np.asarray(solar_panels, dtype=np.int32))
+        self.houses = np.zeros((width, height), dtype=bool)
+        self.houses[x[np.asarray(types) == 1], y[np.asarray(types) == 1]] = True
+
+    @classmethod
+    def from_agents(cls, agents, width, height):
+        """Build the rasters from placed household agents."""
+        x = [a.pos[0] for a in agents]
+        y = [a.pos[1] for a in agents]
+        types = [a.type for a in agents]
+        solar_panels = [a.solar_panels for a in agents]
+        return cls(x, y, types, solar_panels, width, height)
+
+    def add_adopter(self, pos):
+        """Register a household at grid position `pos` that installed solar panels."""
+        self.adopters[pos[0], pos[1]] += 1
+
+    def adopter_share(self):
+        """Share of the households of every cell with solar panels (0 for empty cells)."""
+        return np.divide(self.adopters, self.occupants, out=np.zeros(self.occupants.shape), where=self.occupants > 0)
+
+    def neighbourhood_counts(self):
+        """
+        Number of neighbors and of adopting neighbors of a household in every cell.
+
+        Apartments count every household of their own cell (themselves included) as
+        neighbors, houses only the surrounding cells, as in `Household.get_neighbours`.
+
+        Returns:
+            tuple: (adopting neighbors, neighbors) rasters.
+        """
+        neighbour_adopters = box_sum(self.adopters)
+        neighbours = box_sum(self.occupants)
+        neighbour_adopters[self.houses] -= self.adopters[self.houses]
+        neighbours[self.houses] -= self.occupants[self.houses]
+        return neighbour_adopters, neighbours
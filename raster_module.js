@@ -0,0 +1,57 @@
+/*
+ * Client side of server.py's RasterGrid: keeps the map as one pixel per grid cell, draws it scaled
+ * onto the canvas, and applies the changed cells the server sends after every step.
+ */
+var RasterModule = function(canvas_width, canvas_height) {
+	// Cell state codes (see server.py): empty, low, mid and high income, solar panels
+	var COLORS = [[255, 255, 255], [255, 0, 0], [255, 165, 0], [0, 128, 0], [0, 0, 255]];
+
+	var canvas = $(`<canvas width="${canvas_width}" height="${canvas_height}" class="world-grid"/>`)[0];
+	var parent = $('<div style="height:' + canvas_height + 'px;" class="world-grid-parent"></div>')[0];
+	$("#elements").append(parent);
+	parent.append(canvas);
+	var context = canvas.getContext("2d");
+
+	// Off-screen raster of grid_width x grid_height pixels
+	var raster = document.createElement("canvas");
+	var rasterContext = raster.getContext("2d");
+	var image = null;
+	var gridHeight = 0;
+
+	// Cell index x * height + y; y grows upwards, as in Mesa's CanvasGrid
+	var setCell = function(index, code) {
+		var x = Math.floor(index / gridHeight);
+		var y = index % gridHeight;
+		var offset = 4 * ((gridHeight - y - 1) * image.width + x);
+		var color = COLORS[code];
+		image.data[offset] = color[0];
+		image.data[offset + 1] = color[1];
+		image.data[offset + 2] = color[2];
+		image.data[offset + 3] = 255;
+	};
+
+	this.render = function(data) {
+		if (data.full) {
+			gridHeight = data.height;
+			raster.width = data.width;
+			raster.height = data.height;
+			image = rasterContext.createImageData(data.width, data.height);
+			for (var i = 0; i < data.cells.length; i++)
+				setCell(i, data.cells.charCodeAt(i) - 48);
+		} else if (image !== null) {
+			for (var k = 0; k < data.index.length; k++)
+				setCell(data.index[k], data.codes.charCodeAt(k) - 48);
+		} else {
+			return;
+		}
+		rasterContext.putImageData(image, 0, 0);
+		context.imageSmoothingEnabled = false;
+		context.clearRect(0, 0, canvas.width, canvas.height);
+		context.drawImage(raster, 0, 0, canvas.width, canvas.height);
+	};
+
+	this.reset = function() {
+		image = null;
+		context.clearRect(0, 0, canvas.width, canvas.height);
+	};
+};
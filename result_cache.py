@@ -0,0 +1,124 @@
+import glob
+import hashlib
+import inspect
+import json
+import os
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from city import CityModel
+from rng import as_seed_sequence
+
+# Modules whose code determines the results of a run; changing any of them invalidates the cache
+MODEL_MODULES = ["array_engine.py", "city.py", "emergence_analysis.py", "ensemble.py", "event_engine.py", "grid.py",
+                 "household.py", "neighbors.py", "population.py", "raster.py", "rng.py"]
+
+# CityModel arguments that do not change the collected results
+NON_RESULT_PARAMS = ("seed", "population", "metrics_sink", "profile")
+
+
+@lru_cache(maxsize=None)
+def code_version():
+    """Hash of the source of the model modules, so cached results expire when the model changes."""
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in MODEL_MODULES:
+        digest.update(name.encode())
+        with open(os.path.join(directory, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def model_params(**params):
+    """The complete `CityModel` parameter set of a run: `params` with the defaults of the omitted arguments."""
+    defaults = {name: parameter.default for name, parameter in inspect.signature(CityModel.__init__).parameters.items()
+                if parameter.default is not inspect.Parameter.empty and name not in NON_RESULT_PARAMS}
+    return {**defaults, **params}
+
+
+def run_key(params, seed):
+    """
+    Cache key of a run.
+
+    Args:
+        params (dict): Everything besides the seed the results depend on (e.g. `model_params`),
+            JSON serializable.
+        seed (int | numpy.random.SeedSequence): Seed of the run (not None: runs with fresh entropy
+            cannot be reproduced, so they must not be cached).
+
+    Returns:
+        str: Hex sha256 of the parameters, the seed and the model code version.
+    """
+    if seed is None:
+        raise ValueError("Runs without a seed cannot be cached.")
+    seed = as_seed_sequence(seed)
+    content = json.dumps({"params": params, "seed": [str(seed.entropy), list(seed.spawn_key), seed.pool_size],
+                          "code": code_version()}, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    On-disk cache of finished runs, addressed by `run_key`.
+
+    Every entry is the DataFrame of one run, stored as a compressed npz file with one array per
+    column. Reading an entry marks it as recently used; when the cache grows beyond `max_bytes`,
+    the least recently used entries are removed.
+    """
+
+    def __init__(self, directory, max_bytes=2 ** 30):
+        """
+        Args:
+            directory (str): Directory of the cache (created if needed).
+            max_bytes (int): Size the cache is kept under.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def get(self, key):
+        """The cached DataFrame of run `key`, or None if it is not cached."""
+        path = self.path(key)
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                columns = entry["columns"].tolist()
+                df = pd.DataFrame({name: entry[f"column_{k}"] for k, name in enumerate(columns)},
+                                  index=pd.Index(entry["index"], name=str(entry["index_name"]) or None))
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            return None
+        os.utime(path)
+        return df
+
+    def put(self, key, df):
+        """Store the DataFrame of run `key` and evict the least recently used entries beyond the size bound."""
+        path = self.path(key)
+        temporary = f"{path}.tmp.npz"
+        arrays = {f"column_{k}": df[name].to_numpy() for k, name in enumerate(df.columns)}
+        np.savez_compressed(temporary, index=df.index.to_numpy(), index_name=np.asarray(df.index.name or ""),
+                            columns=np.asarray([str(name) for name in df.columns]), **arrays)
+        os.replace(temporary, path)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in `max_bytes`."""
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, "*.npz")):
+            if path.endswith(".tmp.npz"):
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
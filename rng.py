@@ -0,0 +1,63 @@
+import random
+import numpy as np
+
+# Independent streams derived from a model's seed
+PLACEMENT_STREAM = 0  # city generation: neighborhoods, traits and positions
+DYNAMICS_STREAM = 1   # subsidy assignment and utility noise
+SPAWN_STREAM = 2      # parent of the seeds handed out by `spawn_seeds`
+
+
+def as_seed_sequence(seed=None):
+    """
+    Turn a seed into a NumPy SeedSequence.
+
+    Args:
+        seed (None | int | numpy.random.SeedSequence): None draws fresh entropy from the OS.
+
+    Returns:
+        numpy.random.SeedSequence: The seed sequence.
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
+
+def child_seed(seed, key):
+    """
+    Derive the child stream `key` of a seed.
+
+    Unlike `SeedSequence.spawn`, this does not change the parent, so the same seed always
+    yields the same children no matter how often or in which order they are requested.
+
+    Args:
+        seed (None | int | numpy.random.SeedSequence): Parent seed.
+        key (int): Index of the child stream.
+
+    Returns:
+        numpy.random.SeedSequence: The child seed sequence.
+    """
+    parent = as_seed_sequence(seed)
+    return np.random.SeedSequence(parent.entropy, spawn_key=tuple(parent.spawn_key) + (key,),
+                                  pool_size=parent.pool_size)
+
+
+def spawn_seeds(seed, n):
+    """
+    Independent child seeds, e.g. one per replicate or one per worker process.
+
+    The seeds are children of the dedicated `SPAWN_STREAM` of `seed`, so none of them equals
+    the placement or dynamics stream of a model seeded with `seed` itself.
+    """
+    spawner = child_seed(seed, SPAWN_STREAM)
+    return [child_seed(spawner, i) for i in range(n)]
+
+
+def numpy_generator(seed):
+    """NumPy Generator driven by `seed`."""
+    return np.random.default_rng(as_seed_sequence(seed))
+
+
+def python_random(seed):
+    """`random.Random` instance driven by `seed`, for code written against the standard library API."""
+    state = as_seed_sequence(seed).generate_state(4, np.uint64)
+    return random.Random(int.from_bytes(state.tobytes(), "little"))
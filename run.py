@@ -1,18 +1,16 @@
 import argparse
-import random
+import os
 import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 from city import CityModel
+from metrics_sink import MetricsSink
 import warnings
 warnings.filterwarnings("ignore", category=RuntimeWarning)
 
 
 """This script runs the CityModel simulation for solar panel adoption, collects results, and generates visualizations."""
 
-random.seed(42)  # For reproducibility
-
-
 def parse_arguments():
     """
     Parse command-line arguments for the simulation parameters.
@@ -29,6 +27,13 @@ def parse_arguments():
     parser.add_argument('--subsidy_timestep', type=int, default=0, help='Time step when subsidy starts')
     parser.add_argument('--num_steps', type=int, default=200, help='Number of steps to simulate')
     parser.add_argument('--flag_random', type=int, default=0, help='Randomize grid generation(1) or not (0)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for reproducibility')
+    parser.add_argument('--engine', type=str, default='agent', choices=['agent', 'array', 'event'], help='Simulation engine: per-agent loop, vectorized arrays or next-event')
+    parser.add_argument('--checkpoint', type=str, default=None, help='Checkpoint file to save the simulation state to')
+    parser.add_argument('--checkpoint_every', type=int, default=50, help='Save a checkpoint every k steps (with --checkpoint)')
+    parser.add_argument('--metrics_dir', type=str, default="csv/solar_adoption_metrics", help='Directory the per-step metrics are streamed to while the simulation runs')
+    parser.add_argument('--profile', action='store_true', help='Time the model phases and reporters and save them to csv/profile.csv')
+    parser.add_argument('--resume', action='store_true', help='Continue from --checkpoint if it exists instead of starting over')
 
     # Beta parameters
     parser.add_argument('--beta1', type=float, default=0.35, help='Weight for income')
@@ -44,6 +49,8 @@ def parse_arguments():
 def run_simulation(args):
     """
     Initialize and run the CityModel simulation based on provided arguments.
+    The metrics are streamed to --metrics_dir as the simulation runs.
+    With --resume, the simulation continues from the state saved in --checkpoint.
 
     Args:
         args (argparse.Namespace): Parsed command-line arguments.
@@ -51,27 +58,35 @@ def run_simulation(args):
     Returns:
         CityModel: The simulated model instance after running for the specified steps.
     """
-    random.seed(42)  # For reproducibility
-
-    model = CityModel(
-        width=args.width,
-        height=args.height,
-        num_agents=args.num_agents,
-        subsidy=args.subsidy,
-        subsidy_timestep=args.subsidy_timestep,
-        max_steps=args.num_steps,
-        beta1=args.beta1,
-        beta2=args.beta2,
-        beta3=args.beta3,
-        beta4=args.beta4,
-        beta5=args.beta5,
-        beta6=args.beta6,
-        beta7=args.beta7,
-        flag_random=args.flag_random
-    )
-
-    for step in range(args.num_steps):
+    if args.resume and args.checkpoint is not None and os.path.exists(args.checkpoint):
+        model = CityModel.from_checkpoint(args.checkpoint, metrics_sink=MetricsSink(args.metrics_dir, append=True))
+        print(f"Resuming from step {model.schedule.time} of {args.checkpoint}")
+    else:
+        model = CityModel(
+            width=args.width,
+            height=args.height,
+            num_agents=args.num_agents,
+            subsidy=args.subsidy,
+            subsidy_timestep=args.subsidy_timestep,
+            max_steps=args.num_steps,
+            beta1=args.beta1,
+            beta2=args.beta2,
+            beta3=args.beta3,
+            beta4=args.beta4,
+            beta5=args.beta5,
+            beta6=args.beta6,
+            beta7=args.beta7,
+            flag_random=args.flag_random,
+            engine=args.engine,
+            seed=args.seed,
+            metrics_sink=MetricsSink(args.metrics_dir),
+            profile=args.profile
+        )
+
+    while model.schedule.time < args.num_steps:
         model.step()
+        if args.checkpoint is not None and model.schedule.time % args.checkpoint_every == 0:
+            model.save_checkpoint(args.checkpoint)
 
     return model
 
@@ -86,7 +101,7 @@ def save_results(model):
     Returns:
         pandas.DataFrame: DataFrame containing model variables collected during simulation.
     """
-    results = model.datacollector.get_model_vars_dataframe()
+    results = model.get_model_vars_dataframe()
     results.to_csv("csv/solar_adoption.csv", index=False)
     print("Simulation complete. Data saved to solar_adoption.csv")
     return results
@@ -190,6 +205,10 @@ def main():
     args = parse_arguments()
     model = run_simulation(args)
     results = save_results(model)
+    if args.profile:
+        profile = model.profiler.summary()
+        profile.to_csv("csv/profile.csv")
+        print(profile)
     print_income_summary(model)
     plot_time_series(results, model)
     plot_adoption_histogram(results, model)
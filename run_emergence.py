@@ -1,53 +1,39 @@
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from city import CityModel
 import matplotlib.pyplot as plt
 import warnings
 from scipy.stats import norm
 import numpy as np
 import pandas as pd
+from rng import as_seed_sequence, spawn_seeds
+from population import build_population
+from result_cache import ResultCache, model_params, run_key
 warnings.filterwarnings("ignore", category=RuntimeWarning)
 
 
 """This script runs the Citymodel simulation with and without subsidy, 
    collects results, and generates visualizations comparing the emergent phenomena of the two scenarios."""
 
-def run_model_comparison(args):
-    """    Run the CityModel simulation with and without subsidies, collecting results for comparison."""
+def scenario_params(args, subsidy):
+    """Complete CityModel parameters of the scenario with (1) or without (0) subsidy."""
+    return model_params(width=args.width, height=args.height, num_agents=args.num_agents, subsidy=subsidy,
+                        subsidy_timestep=args.subsidy_timestep, max_steps=args.max_steps, beta1=args.beta1,
+                        beta2=args.beta2, beta3=args.beta3, beta4=args.beta4, beta5=args.beta5, beta6=args.beta6,
+                        beta7=args.beta7, flag_random=args.flag_random, engine=args.engine,
+                        collect_every=args.collect_every)
+
+
+def run_model_comparison(args, seed=None):
+    """    Run the CityModel simulation with and without subsidies, collecting results for comparison.
+    Both models get the same seed, so they simulate the same city with the same random draws."""
+    seed = as_seed_sequence(seed)
+    # The city is generated once and shared by both scenarios
+    population = build_population(args.width, args.height, args.num_agents, args.flag_random, seed)
+
     # Initialize models with and without subsidies
-    model_with_subsidy = CityModel(
-        width=args.width,
-        height=args.height,
-        num_agents=args.num_agents,
-        subsidy=1,
-        subsidy_timestep=args.subsidy_timestep,
-        max_steps=args.max_steps,
-        beta1=args.beta1,
-        beta2=args.beta2,
-        beta3=args.beta3,
-        beta4=args.beta4,
-        beta5=args.beta5,
-        beta6=args.beta6,
-        beta7=args.beta7,
-        flag_random=args.flag_random
-    )
-
-
-    model_without_subsidy = CityModel(
-        width=args.width,
-        height=args.height,
-        num_agents=args.num_agents,
-        subsidy=0,
-        subsidy_timestep=args.subsidy_timestep,
-        max_steps=args.max_steps,
-        beta1=args.beta1,
-        beta2=args.beta2,
-        beta3=args.beta3,
-        beta4=args.beta4,
-        beta5=args.beta5,
-        beta6=args.beta6,
-        beta7=args.beta7,
-        flag_random=args.flag_random
-    )
+    model_with_subsidy = CityModel(**scenario_params(args, 1), seed=seed, population=population)
+    model_without_subsidy = CityModel(**scenario_params(args, 0), seed=seed, population=population)
 
     # Run both models
     model_with_subsidy.run_model(steps=args.max_steps)
@@ -55,38 +41,95 @@ def run_model_comparison(args):
     model_without_subsidy.run_model(steps=args.max_steps)
     print("Model without subsidy completed.")
 
-    # Create DataFrames
-    df_with = model_with_subsidy.datacollector.get_model_vars_dataframe()
-    df_without = model_without_subsidy.datacollector.get_model_vars_dataframe()
+    # Create DataFrames indexed by step
+    df_with = model_with_subsidy.get_model_vars_dataframe()
+    df_without = model_without_subsidy.get_model_vars_dataframe()
 
     return df_with, df_without
 
+class RunningStats:
+    """
+    Online (Welford) per-cell mean and variance of equally shaped DataFrames.
+
+    Replicates are folded in one at a time, so memory does not grow with their number.
+    NaN cells (e.g. Moran's I before anyone adopts) are skipped, like pandas' mean and std.
+    """
+
+    def __init__(self):
+        self.index = None
+        self.columns = None
+        self.count = None
+        self.mean = None
+        self.m2 = None
+
+    def add(self, df):
+        """Fold one replicate into the running statistics."""
+        values = df.to_numpy(dtype=float)
+        if self.mean is None:
+            self.index, self.columns = df.index, df.columns
+            self.count = np.zeros(values.shape)
+            self.mean = np.zeros(values.shape)
+            self.m2 = np.zeros(values.shape)
+        valid = ~np.isnan(values)
+        self.count += valid
+        delta = np.where(valid, values - self.mean, 0.0)
+        self.mean += np.divide(delta, self.count, out=np.zeros(values.shape), where=valid)
+        self.m2 += np.where(valid, delta * (values - self.mean), 0.0)
+
+    def means(self):
+        """Per-cell mean over the replicates (NaN where no replicate had a value)."""
+        return pd.DataFrame(np.where(self.count > 0, self.mean, np.nan), index=self.index, columns=self.columns)
+
+    def stds(self):
+        """Per-cell sample standard deviation over the replicates."""
+        variance = np.divide(self.m2, self.count - 1, out=np.full(self.m2.shape, np.nan), where=self.count > 1)
+        return pd.DataFrame(np.sqrt(variance), index=self.index, columns=self.columns)
+
+
 def run_multiple_times(args):
-    """Run the model comparison multiple times to collect replicates."""
+    """Run the model comparison multiple times on a process pool, aggregating the replicates as they finish."""
     z = norm.ppf(0.975)  # for 95% confidence interval
-    n_runs = 50          # number of replicates
-
-    # Collect all replicates
-    dfs_with = []
-    dfs_without = []
-
-    for i in range(n_runs):
-        print(f"Running replicate {i+1}/{n_runs}")
-        df_with, df_without = run_model_comparison(args)
-        
-        dfs_with.append(df_with.reset_index(drop=True))
-        dfs_without.append(df_without.reset_index(drop=True))
-    return dfs_with, dfs_without, z, n_runs
-
-def compute_mean_ci(dfs, z, n_runs):
-    """Compute mean and confidence intervals for the collected DataFrames."""
-    combined = pd.concat(dfs, axis=1)
-    # Group columns: each metric appears n_runs times, so we average every n-th column set
-    means = pd.concat([combined.iloc[:, i::len(dfs[0].columns)].mean(axis=1) for i in range(len(dfs[0].columns))], axis=1)
-    stds = pd.concat([combined.iloc[:, i::len(dfs[0].columns)].std(axis=1) for i in range(len(dfs[0].columns))], axis=1)
-    cis = z * stds / np.sqrt(n_runs)
-    means.columns = dfs[0].columns
-    cis.columns = dfs[0].columns
+    n_runs = args.runs   # number of replicates
+
+    stats_with = RunningStats()
+    stats_without = RunningStats()
+
+    # Independent random streams per replicate, all derived from --seed
+    seeds = spawn_seeds(args.seed, n_runs)
+
+    # Replicates already simulated with the same parameters, seed and model code are read from the cache
+    # (only with a fixed --seed: runs with fresh entropy are never repeated)
+    cache = ResultCache(args.cache_dir, args.cache_size * 2 ** 20) if args.cache_dir and args.seed is not None else None
+    futures = {}
+    completed = 0
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        for seed in seeds:
+            keys = None
+            if cache is not None:
+                keys = (run_key(scenario_params(args, 1), seed), run_key(scenario_params(args, 0), seed))
+                df_with, df_without = cache.get(keys[0]), cache.get(keys[1])
+                if df_with is not None and df_without is not None:
+                    stats_with.add(df_with)
+                    stats_without.add(df_without)
+                    completed += 1
+                    continue
+            futures[pool.submit(run_model_comparison, args, seed)] = keys
+        print(f"{completed}/{n_runs} replicates read from the cache.")
+        for future in as_completed(futures):
+            df_with, df_without = future.result()
+            if cache is not None:
+                cache.put(futures[future][0], df_with)
+                cache.put(futures[future][1], df_without)
+            stats_with.add(df_with)
+            stats_without.add(df_without)
+            completed += 1
+            print(f"Completed replicate {completed}/{n_runs}")
+    return stats_with, stats_without, z
+
+def compute_mean_ci(stats, z):
+    """Compute mean and confidence intervals from the running statistics of the replicates."""
+    means = stats.means()
+    cis = z * stats.stds() / np.sqrt(stats.count)
     return means, cis
 
 def plot_results(mean_with, mean_without, ci_with, ci_without):
@@ -157,6 +200,13 @@ def main():
     parser.add_argument('--subsidy_timestep', type=int, default=0, help='Timestep at which subsidy starts')
     parser.add_argument('--max_steps', type=int, default=1000, help='Number of simulation steps')
     parser.add_argument('--flag_random', type=int, default=0, help='Randomize grid generation(1) or not (0)')
+    parser.add_argument('--runs', type=int, default=50, help='Number of replicates')
+    parser.add_argument('--processes', type=int, default=None, help='Number of worker processes (default: all cores)')
+    parser.add_argument('--collect_every', type=int, default=1, help='Collect the emergence metrics every k steps')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducibility (fresh entropy if omitted)')
+    parser.add_argument('--engine', type=str, default='agent', choices=['agent', 'array', 'event'], help='Simulation engine: per-agent loop, vectorized arrays or next-event')
+    parser.add_argument('--cache_dir', type=str, default="csv/run_cache", help='Directory finished runs are cached in (empty to disable)')
+    parser.add_argument('--cache_size', type=int, default=1024, help='Size limit of the run cache in MiB')
 
     
     # Beta parameters
@@ -169,9 +219,9 @@ def main():
     parser.add_argument('--beta7', type=float, default=0.6, help='Weight for housing type')
 
     args = parser.parse_args()
-    dfs_with, dfs_without, z, n_runs = run_multiple_times(args)
-    means_with, ci_with = compute_mean_ci(dfs_with, z, n_runs)
-    means_without, ci_without = compute_mean_ci(dfs_without, z, n_runs)
+    stats_with, stats_without, z = run_multiple_times(args)
+    means_with, ci_with = compute_mean_ci(stats_with, z)
+    means_without, ci_without = compute_mean_ci(stats_without, z)
     plot_results(means_with, means_without, ci_with, ci_without)
 
 if __name__ == "__main__":
@@ -1,13 +1,26 @@
-from mesa.batchrunner import BatchRunner
+import argparse
+import hashlib
+import json
+import os
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from SALib.sample import saltelli
 from SALib.analyze import sobol
+import numpy as np
 import pandas as pd
 from city import CityModel
-from IPython.display import clear_output
+from ensemble import Ensemble
+from rng import as_seed_sequence, child_seed
+from population import Population, build_population, snapshot_path
+from result_cache import ResultCache, model_params, run_key
+from emergence_analysis import adoption_count_reporters, clustering_score, morans_I_from_raster
 from visualize_funcs import plot_sensitivity_indices
 import warnings
 warnings.filterwarnings("ignore", category=RuntimeWarning)
 
+# Columns of the runs file recording the `sweep_config` every run was simulated with
+RUN_CONFIG_COLUMNS = ["max_steps", "seed", "fixed_params"]
+
 
 """This script performs Sobol sensitivity analysis on the CityModel simulation
    to understand how different parameters affect solar panel adoption. First order, second order, and total order indices are calculated.
@@ -30,18 +43,20 @@ def define_sobol_problem():
     }
 
 
-def generate_param_samples(problem, distinct_samples):
+def generate_param_samples(problem, distinct_samples, skip_values=None):
     """
     Generate parameter samples using Saltelli's sampling method.
 
     Args:
         problem (dict): Sobol problem definition.
         distinct_samples (int): Number of distinct samples to generate.
+        skip_values (int | None): Number of Sobol' sequence points to skip (SALib's default if None).
+            With a fixed value, the samples of a smaller design are the first rows of a larger one.
 
     Returns:
         numpy.ndarray: Parameter value samples.
     """
-    return saltelli.sample(problem, distinct_samples, calc_second_order=True)
+    return saltelli.sample(problem, distinct_samples, calc_second_order=True, skip_values=skip_values)
 
 
 def get_fixed_params():
@@ -58,6 +73,10 @@ def get_fixed_params():
         "subsidy": 1,
         "subsidy_timestep": 0,
         "max_steps": 1,
+        "flag_random": 0,
+        # Only the final adoption counts are analysed: skip the model's own per-step metrics
+        "collect_every": None,
+        "reporters": [],
     }
 
 
@@ -66,109 +85,368 @@ def get_model_reporters():
     Define model reporters to collect solar panel adoption statistics by income and housing type.
 
     Returns:
-        dict: Reporter functions mapping reporter names to lambdas extracting values from the model.
+        dict: Reporter functions mapping reporter names to functions reading the model's adoption counters.
     """
-    return {
-        "Low Income Solar House": lambda m: sum(1 for a in m.schedule.agents if a.income == 1 and a.solar_panels and a.type == 1),
-        "Low Income Solar Apartment": lambda m: sum(1 for a in m.schedule.agents if a.income == 1 and a.solar_panels and a.type == 2),
-        "Mid Income Solar House": lambda m: sum(1 for a in m.schedule.agents if a.income == 2 and a.solar_panels and a.type == 1),
-        "Mid Income Solar Apartment": lambda m: sum(1 for a in m.schedule.agents if a.income == 2 and a.solar_panels and a.type == 2),
-        "High Income Solar House": lambda m: sum(1 for a in m.schedule.agents if a.income == 3 and a.solar_panels and a.type == 1),
-        "High Income Solar Apartment": lambda m: sum(1 for a in m.schedule.agents if a.income == 3 and a.solar_panels and a.type == 2),
-        "Total Solar Panels": lambda m: sum(a.solar_panels for a in m.schedule.agents),
-    }
+    return adoption_count_reporters()
 
 
-def run_batch_simulations(problem, param_values, replicates, fixed_params, reporters, max_steps):
+def spatial_metrics(rasters):
     """
-    Run batch simulations for all parameter samples and replicates.
+    Emergence metrics of a run's final state, computed once from its per-cell rasters.
+
+    Args:
+        rasters (CellRasters): Per-cell household and adopter counts at the end of the run.
+
+    Returns:
+        dict: Clustering score and Moran's I (nan while no cell differs from the others).
+    """
+    return {"Clustering Score": clustering_score(rasters), "Moran's I": morans_I_from_raster(rasters.adopter_share())}
+
+
+def run_outputs():
+    """Names of the outputs recorded for every run: the adoption counts and the final emergence metrics."""
+    return [*get_model_reporters(), "Clustering Score", "Moran's I"]
+
+
+@lru_cache(maxsize=4)
+def load_city(path):
+    """Load a city snapshot once per worker process; all samples of a replicate share it."""
+    return Population.load(path)
+
+
+def simulate_sample(task):
+    """
+    Run one simulation of a parameter sample (executed in a worker process).
+
+    Args:
+        task (tuple): (sample index, replicate index, parameter dict, fixed parameters, steps, seed,
+            city snapshot path).
+
+    Returns:
+        dict: Sample and replicate indices, parameter values, the final adoption counts and the
+            final emergence metrics (see `spatial_metrics`).
+    """
+    sample, replicate, variable_dict, fixed_params, max_steps, seed, city = task
+    model = CityModel(**fixed_params, **variable_dict, seed=seed, population=load_city(city))
+    model.run_model(max_steps)
+    counts = {name: reporter(model) for name, reporter in get_model_reporters().items()}
+    return {"sample": sample, "replicate": replicate, **variable_dict, **counts, **spatial_metrics(model.rasters)}
+
+
+def simulate_ensemble(task):
+    """
+    Run a batch of parameter samples of one replicate as a single `Ensemble` (executed in a worker process).
+
+    Args:
+        task (tuple): (sample indices, replicate index, parameter dicts, fixed parameters, steps, seeds,
+            city snapshot path).
+
+    Returns:
+        list: One dict per sample, as `simulate_sample` returns.
+    """
+    samples, replicate, variable_dicts, fixed_params, max_steps, seeds, city = task
+    scenario = {"subsidy": fixed_params["subsidy"], "subsidy_timestep": fixed_params["subsidy_timestep"]}
+    ensemble = Ensemble(load_city(city), [{**scenario, **variable_dict} for variable_dict in variable_dicts], seeds)
+    ensemble.run(max_steps)
+    counts = ensemble.adoption_counts().to_dict("records")
+    return [{"sample": sample, "replicate": replicate, **variable_dict, **row, **spatial_metrics(ensemble.cell_rasters(s))}
+            for s, (sample, variable_dict, row) in enumerate(zip(samples, variable_dicts, counts))]
+
+
+def sweep_config(fixed_params, max_steps, seed):
+    """
+    Settings every run of a sweep must share to be analysed together, recorded with each run.
 
     Args:
-        problem (dict): Sobol problem definition.
-        param_values (numpy.ndarray): Parameter samples to run.
-        replicates (int): Number of replicates per parameter set.
         fixed_params (dict): Fixed parameters for the model.
-        reporters (dict): Model reporters for data collection.
         max_steps (int): Number of steps to run each simulation.
+        seed (numpy.random.SeedSequence): Root seed of the sweep.
 
     Returns:
-        list: List of dictionaries with parameter values and simulation results.
-    """
-    batch = BatchRunner(
-        CityModel,
-        fixed_parameters=fixed_params,
-        variable_parameters={name: [] for name in problem['names']},
-        max_steps=max_steps,
-        model_reporters=reporters,
-        display_progress=True,
-    )
-
-    results = []
-    count = 0
-    total = len(param_values) * replicates
+        dict: max_steps, the entropy of the root seed and a hash of the fixed parameters, as strings.
+    """
+    fixed = json.dumps(fixed_params, sort_keys=True, default=str)
+    return {"max_steps": str(max_steps), "seed": str(seed.entropy),
+            "fixed_params": hashlib.sha256(fixed.encode()).hexdigest()[:16]}
 
-    for i in range(replicates):
-        print(f"Running replicate {i + 1}/{replicates}...")
-        for params in param_values:
-            print(f"Parameters: {params}")
-            variable_dict = dict(zip(problem['names'], params))
-            batch.run_iteration(variable_dict, tuple(params), count)
-            result = batch.get_model_vars_dataframe().iloc[count]
 
-            results.append({
-                **variable_dict,
-                "Low Income Solar House": result["Low Income Solar House"],
-                "Low Income Solar Apartment": result["Low Income Solar Apartment"],
-                "Mid Income Solar House": result["Mid Income Solar House"],
-                "Mid Income Solar Apartment": result["Mid Income Solar Apartment"],
-                "High Income Solar House": result["High Income Solar House"],
-                "High Income Solar Apartment": result["High Income Solar Apartment"],
-                "Total Solar Panels": result["Total Solar Panels"],
-            })
+def load_completed_runs(problem, param_values, results_path, runner, config):
+    """
+    Read the runs already streamed to `results_path` by an interrupted sweep.
+
+    Args:
+        problem (dict): Sobol problem definition.
+        param_values (numpy.ndarray): Parameter samples of the sweep.
+        results_path (str): CSV file the sweep streams its results to.
+        runner (str): "model" or "ensemble", the runner of the resuming sweep; runs of the other
+            runner follow another update rule, so they cannot be mixed into the same analysis.
+        config (dict): `sweep_config` of the resuming sweep; runs with other settings are refused.
+
+    Returns:
+        set: (sample, replicate) pairs that do not need to run again.
+    """
+    if not os.path.exists(results_path) or os.path.getsize(results_path) == 0:
+        return set()
+    done = pd.read_csv(results_path, dtype={name: str for name in config})
+    if "sample" not in done.columns or "runner" not in done.columns or any(name not in done.columns for name in config):
+        raise ValueError(f"{results_path} was not written by a parallel sweep; remove it or use another path.")
+    runners = set(done["runner"])
+    if runners != {runner}:
+        raise ValueError(f"{results_path} holds runs of the {sorted(runners)} runner, not '{runner}' "
+                         f"(set --ensemble_size as in the original sweep); remove it or use another path.")
+    for name, value in config.items():
+        values = set(done[name])
+        if values != {value}:
+            raise ValueError(f"{results_path} holds runs with {name} {sorted(values)}, not {value} (set --max_steps, "
+                             f"--seed and the model parameters as in the original sweep); remove it or use another path.")
+    # Runs of a larger design sharing the first samples (see `run_adaptive_sobol`) are kept but not needed
+    done = done[done["sample"] < len(param_values)]
+    expected = param_values[done["sample"].to_numpy()]
+    if not np.allclose(done[problem['names']].to_numpy(), expected):
+        raise ValueError(f"{results_path} belongs to a sweep with other parameter samples; remove it or use another path.")
+    return set(zip(done["sample"], done["replicate"]))
+
+
+def run_parallel_simulations(problem, param_values, replicates, fixed_params, max_steps, results_path,
+                             processes=None, seed=None, snapshot_dir="csv/snapshots", ensemble_size=None,
+                             cache=None):
+    """
+    Run all parameter samples and replicates on a process pool, streaming every finished run to disk.
+
+    Runs already present in `results_path` are skipped, so an interrupted sweep resumes
+    where it stopped. Every run records its runner and its `sweep_config` (steps, seed and
+    fixed parameters), and resuming with another runner or configuration is refused. The betas only affect the dynamics, so every replicate generates one
+    city, saved as a snapshot in `snapshot_dir`, and all parameter samples of the replicate
+    simulate it. Every run gets its own child seed for the dynamics, determined by its
+    sample and replicate index, so resumed or extended sweeps with a fixed seed give the same
+    results as uninterrupted ones.
 
-            count += 1
-            clear_output(wait=True)
-            print(f"{(count / total) * 100:.2f}% complete")
+    With `ensemble_size`, the samples of a replicate are simulated in batches of that many
+    scenarios by `Ensemble` (the array engine's synchronous update rule) instead of one
+    `CityModel` per run.
 
-    return results
+    With a `cache`, runs already simulated in earlier sweeps with the same parameters, city,
+    seed and model code are read from it instead of simulated again.
 
+    Args:
+        problem (dict): Sobol problem definition.
+        param_values (numpy.ndarray): Parameter samples to run.
+        replicates (int): Number of replicates per parameter set.
+        fixed_params (dict): Fixed parameters for the model.
+        max_steps (int): Number of steps to run each simulation.
+        results_path (str): CSV file the runs are appended to as they finish.
+        processes (int | None): Number of worker processes (all cores if None).
+        seed (None | int): Root seed of the sweep.
+        snapshot_dir (str): Directory the city snapshots of the replicates are stored in.
+        ensemble_size (int | None): Number of samples simulated together per ensemble; None runs
+            every sample as its own CityModel.
+        cache (ResultCache | None): Cache finished runs are stored in and served from.
+
+    Returns:
+        pandas.DataFrame: One row per run of `param_values`, ordered by replicate and sample.
+    """
+    seed = as_seed_sequence(seed)
+    city_seeds, run_seeds = child_seed(seed, 0), child_seed(seed, 1)
+    runner = "model" if ensemble_size is None else "ensemble"
+    config = sweep_config(fixed_params, max_steps, seed)
+    done = load_completed_runs(problem, param_values, results_path, runner, config)
+    tasks, cached_rows, keys = [], [], {}
+    for replicate in range(replicates):
+        pending = [sample for sample in range(len(param_values)) if (sample, replicate) not in done]
+        if not pending:
+            continue
+        city_params = (fixed_params["width"], fixed_params["height"], fixed_params["num_agents"],
+                       fixed_params["flag_random"], child_seed(city_seeds, replicate))
+        city = snapshot_path(snapshot_dir, *city_params)
+        variable_dicts = [{name: float(value) for name, value in zip(problem['names'], param_values[sample])}
+                          for sample in pending]
+        seeds = [child_seed(child_seed(run_seeds, replicate), sample) for sample in pending]
+        if cache is not None:
+            # Runs with the same parameters, city, seed and model code are read from the cache
+            missing = []
+            for k, (sample, variable_dict, run_seed) in enumerate(zip(pending, variable_dicts, seeds)):
+                key = run_key({**model_params(**fixed_params, **variable_dict), "steps": max_steps,
+                               "city": os.path.basename(city), "runner": runner,
+                               "outputs": run_outputs()}, run_seed)
+                counts = cache.get(key)
+                if counts is None:
+                    keys[(sample, replicate)] = key
+                    missing.append(k)
+                else:
+                    cached_rows.append({"sample": sample, "replicate": replicate, **variable_dict, **counts.iloc[0].to_dict()})
+            pending = [pending[k] for k in missing]
+            variable_dicts = [variable_dicts[k] for k in missing]
+            seeds = [seeds[k] for k in missing]
+            if not pending:
+                continue
+        if not os.path.exists(city):
+            os.makedirs(snapshot_dir, exist_ok=True)
+            build_population(*city_params).save(city)
+        if ensemble_size is None:
+            tasks += [(sample, replicate, variable_dict, fixed_params, max_steps, run_seed, city)
+                      for sample, variable_dict, run_seed in zip(pending, variable_dicts, seeds)]
+        else:
+            for start in range(0, len(pending), ensemble_size):
+                batch = slice(start, start + ensemble_size)
+                tasks.append((pending[batch], replicate, variable_dicts[batch], fixed_params, max_steps, seeds[batch], city))
 
-def perform_sobol_analysis(problem, df):
+    total = len(param_values) * replicates
+    count = len(done)
+    print(f"{count}/{total} runs already completed, {len(cached_rows)} read from the cache, "
+          f"{total - count - len(cached_rows)} to go.")
+    simulate = simulate_sample if ensemble_size is None else simulate_ensemble
+    if tasks or cached_rows:
+        write_header = not os.path.exists(results_path) or os.path.getsize(results_path) == 0
+        with ProcessPoolExecutor(max_workers=processes) as pool, open(results_path, "a", newline="") as f:
+            if cached_rows:
+                pd.DataFrame(cached_rows).assign(runner=runner, **config).to_csv(f, header=write_header, index=False)
+                f.flush()
+                write_header = False
+                count += len(cached_rows)
+            futures = [pool.submit(simulate, task) for task in tasks]
+            for future in as_completed(futures):
+                rows = future.result() if ensemble_size is not None else [future.result()]
+                pd.DataFrame(rows).assign(runner=runner, **config).to_csv(f, header=write_header, index=False)
+                f.flush()
+                write_header = False
+                if cache is not None:
+                    for row in rows:
+                        counts = {name: row[name] for name in run_outputs()}
+                        cache.put(keys[(row["sample"], row["replicate"])], pd.DataFrame([counts]))
+                count += len(rows)
+                print(f"{(count / total) * 100:.2f}% complete")
+
+    runs = pd.read_csv(results_path, dtype={name: str for name in config})
+    runs = runs[runs["sample"] < len(param_values)]
+    return runs.sort_values(["replicate", "sample"]).reset_index(drop=True)
+
+
+def average_replicates(df):
+    """Average the runs of every parameter sample over its replicates, ordered by sample."""
+    return df.drop(columns=["replicate", "runner", *RUN_CONFIG_COLUMNS]).groupby("sample").mean().sort_index()
+
+
+def perform_sobol_analysis(problem, df, seed=None):
     """
     Perform Sobol sensitivity analysis on the total solar panels output.
 
     Args:
         problem (dict): Sobol problem definition.
         df (pandas.DataFrame): DataFrame containing simulation results.
+        seed (None | int): Seed of the bootstrap of the confidence intervals.
 
     Returns:
         dict: Dictionary of Sobol indices.
     """
-    Si = sobol.analyze(problem, df["Total Solar Panels"].values, calc_second_order=True)
+    Si = sobol.analyze(problem, df["Total Solar Panels"].values, calc_second_order=True, seed=seed)
     print("First-order indices:", Si['S1'])
     print("Second-order indices:", Si['S2'])
     print("Total-order indices:", Si['ST'])
     return Si
 
 
+def sobol_precision(Si):
+    """Widest confidence interval of the first and total order indices of a Sobol analysis."""
+    return float(np.nanmax(np.concatenate([Si['S1_conf'], Si['ST_conf']])))
+
+
+def run_adaptive_sobol(problem, replicates, fixed_params, max_steps, results_path, tolerance, budget,
+                       initial_samples=8, seed=None, **sweep_options):
+    """
+    Grow the Saltelli design in stages until the Sobol indices are precise enough or the budget is spent.
+
+    Every stage doubles the number of base samples and runs only the new samples: with a fixed
+    `skip_values`, the samples of a stage are the first rows of the next stage's design, and
+    their runs are read back from `results_path`. The indices are recomputed after every stage,
+    and the sweep stops once the widest confidence interval of the first and total order indices
+    is at most `tolerance`, or when the next stage would exceed `budget` runs.
+
+    Args:
+        problem (dict): Sobol problem definition.
+        replicates (int): Number of replicates per parameter sample.
+        fixed_params (dict): Fixed parameters for the model.
+        max_steps (int): Number of steps to run each simulation.
+        results_path (str): CSV file the runs are streamed to (and resumed from).
+        tolerance (float): Target width of the index confidence intervals.
+        budget (int): Maximum number of simulation runs; a ValueError is raised if the first stage
+            alone exceeds it.
+        initial_samples (int): Number of base samples of the first stage (a power of 2).
+        seed (None | int): Root seed of the sweep and of the bootstrap of the confidence intervals.
+        **sweep_options: Passed on to `run_parallel_simulations` (processes, snapshot_dir, ensemble_size, cache).
+
+    Returns:
+        tuple: (Sobol indices of the last stage, runs averaged over replicates, convergence history
+            with one row per stage).
+    """
+    if initial_samples < 1 or initial_samples & (initial_samples - 1):
+        raise ValueError(f"The number of base samples of the first stage must be a power of 2, got {initial_samples}.")
+    runs_per_sample = (2 * problem['num_vars'] + 2) * replicates
+    if initial_samples * runs_per_sample > budget:
+        raise ValueError(f"The first stage alone needs {initial_samples * runs_per_sample} runs ({initial_samples} base "
+                         f"samples x {runs_per_sample} runs each), more than the budget of {budget}; lower --samples "
+                         f"or --replicates, or raise --budget.")
+    max_samples = initial_samples
+    while 2 * max_samples * runs_per_sample <= budget:
+        max_samples *= 2
+    # Skipping as many points as the largest design keeps every stage a prefix of the next one
+    skip_values = max_samples
+
+    history = []
+    samples = initial_samples
+    while True:
+        param_values = generate_param_samples(problem, samples, skip_values)
+        runs = run_parallel_simulations(problem, param_values, replicates, fixed_params, max_steps, results_path,
+                                        seed=seed, **sweep_options)
+        df = average_replicates(runs)
+        Si = perform_sobol_analysis(problem, df, seed=seed)
+        precision = sobol_precision(Si)
+        history.append({"samples": samples, "runs": len(param_values) * replicates,
+                        "S1_conf": float(np.nanmax(Si['S1_conf'])), "ST_conf": float(np.nanmax(Si['ST_conf']))})
+        print(f"{samples} base samples ({len(param_values) * replicates} runs): widest confidence interval {precision:.4f}")
+        if precision <= tolerance:
+            print(f"Reached the tolerance of {tolerance}.")
+            break
+        if samples >= max_samples:
+            print(f"Stopping at the budget of {budget} runs.")
+            break
+        samples *= 2
+    return Si, df, pd.DataFrame(history)
+
+
 def main():
     """
     Main driver function to perform Sobol sensitivity analysis on the CityModel.
     """
-    problem = define_sobol_problem()
-    distinct_samples = 8
-    replicates = 1
-    max_steps = 1
+    parser = argparse.ArgumentParser(description="Sobol sensitivity analysis of the solar panel adoption ABM.")
+    parser.add_argument('--samples', type=int, default=8, help='Number of distinct Saltelli base samples of the first stage (a power of 2)')
+    parser.add_argument('--tolerance', type=float, default=0.05,
+                        help='Stop once the widest S1/ST confidence interval is at most this wide')
+    parser.add_argument('--budget', type=int, default=4096, help='Maximum number of simulation runs')
+    parser.add_argument('--replicates', type=int, default=1, help='Number of replicates per parameter sample')
+    parser.add_argument('--max_steps', type=int, default=1, help='Number of steps to run each simulation')
+    parser.add_argument('--processes', type=int, default=None, help='Number of worker processes (default: all cores)')
+    parser.add_argument('--seed', type=int, default=42, help='Root random seed of the sweep')
+    parser.add_argument('--runs_file', type=str, default="csv/sobol_runs.csv",
+                        help='File the individual runs are streamed to; an existing file is resumed')
+    parser.add_argument('--snapshot_dir', type=str, default="csv/snapshots",
+                        help='Directory the city snapshots shared by the samples of a replicate are stored in')
+    parser.add_argument('--ensemble_size', type=int, default=None,
+                        help='Simulate this many samples at once as one batched ensemble (array engine update rule)')
+    parser.add_argument('--cache_dir', type=str, default="csv/run_cache", help='Directory finished runs are cached in (empty to disable)')
+    parser.add_argument('--cache_size', type=int, default=1024, help='Size limit of the run cache in MiB')
+    args = parser.parse_args()
 
-    param_values = generate_param_samples(problem, distinct_samples)
+    problem = define_sobol_problem()
     fixed_params = get_fixed_params()
-    reporters = get_model_reporters()
+    fixed_params["max_steps"] = args.max_steps
 
-    results = run_batch_simulations(problem, param_values, replicates, fixed_params, reporters, max_steps)
-    df = pd.DataFrame(results)
+    Si, df, history = run_adaptive_sobol(
+        problem, args.replicates, fixed_params, args.max_steps, args.runs_file, args.tolerance, args.budget,
+        initial_samples=args.samples, seed=args.seed, processes=args.processes, snapshot_dir=args.snapshot_dir,
+        ensemble_size=args.ensemble_size,
+        cache=ResultCache(args.cache_dir, args.cache_size * 2 ** 20) if args.cache_dir else None)
     df.to_csv("csv/sobol_sensitivity_results.csv", index=False)
-
-    Si = perform_sobol_analysis(problem, df)
+    history.to_csv("csv/sobol_convergence.csv", index=False)
     plot_sensitivity_indices(Si, problem['names'])
 
 
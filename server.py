@@ -1,6 +1,7 @@
 import argparse
+import numpy as np
 from mesa.visualization.modules import CanvasGrid
-from mesa.visualization.ModularVisualization import ModularServer
+from mesa.visualization.ModularVisualization import ModularServer, VisualizationElement
 from city import CityModel
 import warnings
 warnings.filterwarnings("ignore", category=RuntimeWarning)
@@ -31,6 +32,54 @@ def agent_portrayal(agent):
     portrayal["Layer"] = 0
     return portrayal
 
+
+class RasterGrid(VisualizationElement):
+    """
+    Grid view that sends the map to the browser once and then only the cells that changed.
+
+    Every cell has one state code: 0 empty, 1-3 the income level of its households (of the
+    last one placed, for apartment cells, which is the one `CanvasGrid` draws on top), 4 if any
+    of them has solar panels. The first render of a model sends the codes of all cells as one
+    string; later renders send the indices and codes of the changed cells, usually a handful of
+    new adopters. `raster_module.js` keeps the map as an image with one pixel per cell and
+    draws it scaled to the canvas, so the cost per step does not grow with the number of
+    households. The element remembers what it sent last, so it serves one browser tab.
+    """
+
+    local_includes = ["raster_module.js"]
+
+    def __init__(self, canvas_width=600, canvas_height=600):
+        """
+        Args:
+            canvas_width (int): Width of the canvas in pixels.
+            canvas_height (int): Height of the canvas in pixels.
+        """
+        self.js_code = f"elements.push(new RasterModule({canvas_width}, {canvas_height}));"
+        self.model = None
+        self.cell_income = None
+        self.codes = None
+
+    def cell_codes(self, model):
+        """State code of every cell, indexed by x * height + y."""
+        adopters = model.rasters.adopters.ravel() > 0
+        return np.where(adopters, 4, self.cell_income).astype(np.uint8)
+
+    def render(self, model):
+        if model is not self.model:
+            # A new model (e.g. after a reset): draw the whole map
+            self.model = model
+            self.cell_income = np.zeros(model.grid.width * model.grid.height, dtype=np.uint8)
+            cells = [agent.pos[0] * model.grid.height + agent.pos[1] for agent in model.household_list]
+            self.cell_income[cells] = [agent.income for agent in model.household_list]
+            self.codes = self.cell_codes(model)
+            return {"full": True, "width": model.grid.width, "height": model.grid.height,
+                    "cells": (self.codes + ord("0")).tobytes().decode("ascii")}
+        codes = self.cell_codes(model)
+        changed = np.flatnonzero(codes != self.codes)
+        self.codes = codes
+        return {"full": False, "index": changed.tolist(), "codes": (codes[changed] + ord("0")).tobytes().decode("ascii")}
+
+
 def main():
     parser = argparse.ArgumentParser(description="Launch the Solar Panel ABM Mesa Server.")
 
@@ -41,6 +90,9 @@ def main():
     parser.add_argument('--subsidy_timestep', type=int, default=0, help='Timestep at which subsidy is applied')
     parser.add_argument('--max_steps', type=int, default=500, help='Number of steps the model should run')
     parser.add_argument('--flag_random', type=int, default=0, help='Randomize grid generation(1) or not (0)')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducibility (fresh entropy if omitted)')
+    parser.add_argument('--engine', type=str, default='agent', choices=['agent', 'array', 'event'], help='Simulation engine: per-agent loop, vectorized arrays or next-event')
+    parser.add_argument('--view', type=str, default='raster', choices=['raster', 'agents'], help='Grid view: cell raster updated with the changed cells only, or Mesa\'s per-agent CanvasGrid')
 
     # Beta parameters
     parser.add_argument('--beta1', type=float, default=0.35, help='Weight for income')
@@ -54,7 +106,10 @@ def main():
     args = parser.parse_args()
 
     # Setup canvas and chart modules
-    canvas_element = CanvasGrid(agent_portrayal, args.width, args.height, 600, 600)
+    if args.view == "raster":
+        canvas_element = RasterGrid(600, 600)
+    else:
+        canvas_element = CanvasGrid(agent_portrayal, args.width, args.height, 600, 600)
 
     
 
@@ -73,7 +128,9 @@ def main():
         "beta5": args.beta5,
         "beta6": args.beta6,
         "beta7": args.beta7,
-        "flag_random": args.flag_random
+        "flag_random": args.flag_random,
+        "engine": args.engine,
+        "seed": args.seed
     }
 
     server = ModularServer(
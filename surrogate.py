@@ -0,0 +1,278 @@
+import argparse
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+from sa import define_sobol_problem
+
+
+"""This script fits a polynomial chaos emulator of the CityModel outputs over the seven betas to the
+   runs of a sensitivity sweep. The emulator predicts outputs with their uncertainty, gives the Sobol
+   indices analytically from its coefficients, and suggests the parameter samples to simulate next."""
+
+
+def multi_indices(num_vars, degree):
+    """
+    Exponents of all polynomial terms in `num_vars` variables of total degree at most `degree`.
+
+    Returns:
+        numpy.ndarray: (terms, num_vars) exponents, by increasing total degree; row 0 is the constant.
+    """
+    def terms(num_vars, degree):
+        if num_vars == 1:
+            return [[d] for d in range(degree + 1)]
+        return [[d] + rest for d in range(degree + 1) for rest in terms(num_vars - 1, degree - d)]
+    indices = np.array(terms(num_vars, degree), dtype=int)
+    return indices[np.argsort(indices.sum(axis=1), kind="stable")]
+
+
+def legendre_basis(unit_x, indices):
+    """
+    Orthonormal Legendre polynomials of the uniform distribution on [0, 1]^d.
+
+    Args:
+        unit_x (numpy.ndarray): (points, d) inputs scaled to [0, 1].
+        indices (numpy.ndarray): (terms, d) exponents of the terms (see `multi_indices`).
+
+    Returns:
+        numpy.ndarray: (points, terms) design matrix.
+    """
+    degree = indices.max()
+    t = 2 * unit_x.T - 1
+    # P[v, n] is the degree n Legendre polynomial of variable v, by Bonnet's recursion
+    P = np.ones((unit_x.shape[1], degree + 1, unit_x.shape[0]))
+    if degree >= 1:
+        P[:, 1] = t
+    for n in range(1, degree):
+        P[:, n + 1] = ((2 * n + 1) * t * P[:, n] - n * P[:, n - 1]) / (n + 1)
+    P *= np.sqrt(2 * np.arange(degree + 1) + 1)[None, :, None]  # unit variance under the uniform distribution
+    variables = np.arange(unit_x.shape[1])
+    return np.prod(P[variables, indices], axis=1).T
+
+
+class PolynomialChaosSurrogate:
+    """
+    Bayesian polynomial chaos emulator of one model output over a box of parameters.
+
+    The output is expanded in orthonormal Legendre polynomials of the parameters up to a total
+    degree. The coefficients get a Gaussian prior, and the prior precision and the noise level
+    (which absorbs the replicate-to-replicate variability of the simulations) are set by
+    maximizing the evidence, so the emulator needs no tuning. Because the basis is orthonormal,
+    the variance of the output splits into the squared coefficients of the terms, which gives
+    the Sobol indices directly from the coefficients.
+    """
+
+    def __init__(self, problem, degree=3):
+        """
+        Args:
+            problem (dict): Problem definition with 'num_vars', 'names' and 'bounds' (as in `sa.py`).
+            degree (int): Maximum total degree of the polynomial terms.
+        """
+        self.problem = problem
+        self.bounds = np.asarray(problem['bounds'], dtype=float)
+        self.indices = multi_indices(problem['num_vars'], degree)
+
+    def design(self, X):
+        """Design matrix of parameter values `X` (points x parameters, in the problem's bounds)."""
+        unit_x = (np.asarray(X, dtype=float) - self.bounds[:, 0]) / (self.bounds[:, 1] - self.bounds[:, 0])
+        return legendre_basis(unit_x, self.indices)
+
+    def fit(self, X, y, max_iterations=200, tolerance=1e-8):
+        """
+        Fit the coefficients to simulation outputs.
+
+        Args:
+            X (numpy.ndarray): Parameter values of the runs (runs x parameters).
+            y (numpy.ndarray): Output of every run.
+            max_iterations (int): Maximum number of evidence maximization iterations.
+            tolerance (float): Relative change of the hyperparameters at which the iterations stop.
+
+        Returns:
+            PolynomialChaosSurrogate: self.
+        """
+        y = np.asarray(y, dtype=float)
+        self.y_mean = y.mean()
+        self.y_scale = y.std() if y.std() > 0 else 1.0
+        t = (y - self.y_mean) / self.y_scale
+        Phi = self.design(X)
+        gram, projection = Phi.T @ Phi, Phi.T @ t
+        eigenvalues = np.linalg.eigvalsh(gram)
+
+        # Evidence maximization of the prior precision alpha and the noise precision beta (MacKay)
+        alpha, beta = 1.0, 1.0
+        for _ in range(max_iterations):
+            covariance = np.linalg.inv(alpha * np.eye(len(gram)) + beta * gram)
+            mean = beta * covariance @ projection
+            gamma = np.sum(beta * eigenvalues / (alpha + beta * eigenvalues))
+            residual = np.sum((t - Phi @ mean) ** 2)
+            new_alpha = gamma / max(mean @ mean, 1e-12)
+            new_beta = max(len(t) - gamma, 1e-12) / max(residual, 1e-12)
+            converged = abs(new_alpha - alpha) <= tolerance * alpha and abs(new_beta - beta) <= tolerance * beta
+            alpha, beta = new_alpha, new_beta
+            if converged:
+                break
+        self.alpha, self.beta = alpha, beta
+        self.covariance = np.linalg.inv(alpha * np.eye(len(gram)) + beta * gram)
+        self.coefficients = beta * self.covariance @ projection
+
+        # Leave-one-out residuals of the linear smoother, without refitting
+        leverage = beta * np.einsum("ij,jk,ik->i", Phi, self.covariance, Phi)
+        self.loo_rmse = float(np.sqrt(np.mean(((t - Phi @ self.coefficients) / (1 - leverage)) ** 2)) * self.y_scale)
+        return self
+
+    def predict(self, X, return_std=True):
+        """
+        Emulated output at parameter values `X`.
+
+        Args:
+            X (numpy.ndarray): Parameter values (points x parameters).
+            return_std (bool): Also return the predictive standard deviation of a new simulation,
+                i.e. the emulator's uncertainty plus the run-to-run noise.
+
+        Returns:
+            numpy.ndarray | tuple: Mean, or (mean, standard deviation).
+        """
+        Phi = self.design(np.atleast_2d(X))
+        mean = self.y_mean + self.y_scale * (Phi @ self.coefficients)
+        if not return_std:
+            return mean
+        variance = 1 / self.beta + np.einsum("ij,jk,ik->i", Phi, self.covariance, Phi)
+        return mean, self.y_scale * np.sqrt(variance)
+
+    def sobol_from_coefficients(self, coefficients):
+        """
+        First, second and total order Sobol indices of expansions with the given coefficients.
+
+        Args:
+            coefficients (numpy.ndarray): (draws, terms) coefficients.
+
+        Returns:
+            tuple: (draws, d) first order, (draws, d, d) second order (upper triangle) and (draws, d) total order indices.
+        """
+        active = self.indices > 0
+        squares = coefficients[:, 1:] ** 2
+        variance = squares.sum(axis=1, keepdims=True)
+        variance[variance == 0] = np.nan
+        active, order = active[1:], active[1:].sum(axis=1)
+        S1 = squares @ (active & (order == 1)[:, None]) / variance
+        ST = squares @ active / variance
+        d = self.indices.shape[1]
+        S2 = np.full((len(coefficients), d, d), np.nan)
+        for i in range(d):
+            for j in range(i + 1, d):
+                pair = (order == 2) & active[:, i] & active[:, j]
+                S2[:, i, j] = squares[:, pair].sum(axis=1) / variance[:, 0]
+        return S1, S2, ST
+
+    def sobol_indices(self, draws=1000, conf_level=0.95, seed=None):
+        """
+        Sobol indices of the emulator, with confidence intervals from the coefficients' posterior.
+
+        Returns:
+            dict: 'S1', 'S1_conf', 'S2', 'S2_conf', 'ST' and 'ST_conf', as `SALib.analyze.sobol.analyze` returns them.
+        """
+        S1, S2, ST = self.sobol_from_coefficients(self.coefficients[None, :])
+        samples = np.random.default_rng(seed).multivariate_normal(self.coefficients, self.covariance, size=draws,
+                                                                  method="cholesky")
+        S1_draws, S2_draws, ST_draws = self.sobol_from_coefficients(samples)
+        z = norm.ppf(0.5 + conf_level / 2)
+        # Indices of an output the emulator finds constant are undefined, and so are their intervals
+        conf = lambda index, draws: np.where(np.isnan(index), np.nan, z * draws.std(axis=0))
+        return {
+            'S1': S1[0], 'S1_conf': conf(S1[0], S1_draws),
+            'S2': S2[0], 'S2_conf': conf(S2[0], S2_draws),
+            'ST': ST[0], 'ST_conf': conf(ST[0], ST_draws),
+        }
+
+    def suggest(self, n, candidates=4096, seed=None):
+        """
+        Parameter samples where new simulations would reduce the emulator's uncertainty most.
+
+        Samples are chosen greedily among random candidates by their coefficient uncertainty,
+        which after every choice is updated as if that simulation had been run (its outcome does
+        not matter for the update), so a batch of suggestions spreads out instead of clustering.
+
+        Args:
+            n (int): Number of samples to suggest.
+            candidates (int): Number of random candidate samples to choose from.
+            seed (None | int): Seed of the candidates.
+
+        Returns:
+            numpy.ndarray: (n, parameters) suggested parameter values.
+        """
+        unit_x = np.random.default_rng(seed).random((candidates, len(self.bounds)))
+        X = self.bounds[:, 0] + unit_x * (self.bounds[:, 1] - self.bounds[:, 0])
+        Phi = self.design(X)
+        covariance = self.covariance.copy()
+        variance = np.einsum("ij,jk,ik->i", Phi, covariance, Phi)
+        chosen = []
+        for _ in range(n):
+            best = int(np.argmax(variance))
+            chosen.append(best)
+            gain = covariance @ Phi[best]
+            denominator = 1 / self.beta + Phi[best] @ gain
+            covariance -= np.outer(gain, gain) / denominator
+            variance -= (Phi @ gain) ** 2 / denominator
+            variance[chosen] = -np.inf
+        return X[chosen]
+
+
+def fit_surrogates(runs, problem, outputs, degree=3):
+    """
+    Fit one emulator per output column of a sweep's runs (e.g. `sa.py`'s runs file).
+
+    Runs where an output is undefined (Moran's I is nan while no cell differs from the others)
+    are left out of that output's fit.
+
+    Args:
+        runs (pandas.DataFrame): One row per simulation, with the parameter columns of `problem`.
+        problem (dict): Problem definition of the sweep.
+        outputs (list): Output columns to emulate, e.g. the adoption counts, "Clustering Score" or "Moran's I".
+        degree (int): Maximum total degree of the polynomial terms.
+
+    Returns:
+        dict: Output name to fitted `PolynomialChaosSurrogate`.
+    """
+    X = runs[problem['names']].to_numpy(dtype=float)
+    surrogates = {}
+    for output in outputs:
+        y = runs[output].to_numpy(dtype=float)
+        defined = np.isfinite(y)
+        if not defined.any():
+            raise ValueError(f"{output} is undefined in every run; simulate more steps to emulate it.")
+        surrogates[output] = PolynomialChaosSurrogate(problem, degree).fit(X[defined], y[defined])
+    return surrogates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulate the solar panel adoption ABM from the runs of a sweep.")
+    parser.add_argument('--runs_file', type=str, default="csv/sobol_runs.csv", help='Runs of a sweep (as written by sa.py)')
+    parser.add_argument('--outputs', type=str, nargs='+', default=["Total Solar Panels"],
+                        help='Output columns to emulate (adoption counts, "Clustering Score", "Moran\'s I")')
+    parser.add_argument('--degree', type=int, default=3, help='Maximum total degree of the polynomial chaos terms')
+    parser.add_argument('--suggest', type=int, default=16, help='Number of parameter samples to suggest for the next simulations')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the confidence intervals and of the suggestion candidates')
+    args = parser.parse_args()
+
+    problem = define_sobol_problem()
+    runs = pd.read_csv(args.runs_file)
+    unknown = [name for name in args.outputs if name not in runs.columns]
+    if unknown:
+        raise ValueError(f"Unknown outputs {unknown}, expected some of {list(runs.columns)}.")
+    surrogates = fit_surrogates(runs, problem, args.outputs, args.degree)
+
+    for output, surrogate in surrogates.items():
+        Si = surrogate.sobol_indices(seed=args.seed)
+        print(f"{output}: {runs[output].notna().sum()} runs, {len(surrogate.indices)} terms, leave-one-out RMSE {surrogate.loo_rmse:.4g}")
+        print(pd.DataFrame({"S1": Si['S1'], "S1_conf": Si['S1_conf'], "ST": Si['ST'], "ST_conf": Si['ST_conf']},
+                           index=problem['names']))
+
+    # Suggest where the first output's emulator is least certain
+    suggestions = surrogates[args.outputs[0]].suggest(args.suggest, seed=args.seed)
+    mean, std = surrogates[args.outputs[0]].predict(suggestions)
+    suggestions = pd.DataFrame(suggestions, columns=problem['names']).assign(predicted=mean, predicted_std=std)
+    suggestions.to_csv("csv/surrogate_suggestions.csv", index=False)
+    print("Suggested next simulations saved to csv/surrogate_suggestions.csv")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+import multiprocessing
+import numpy as np
+import pandas as pd
+from array_engine import HouseholdArrays
+from emergence_analysis import (adoption_count_reporters, clustering_terms, compute_global_adoption,
+                                compute_morans_I, gini_between_income_classes, morans_I_from_sums)
+from population import build_population
+from raster import CellRasters
+from rng import as_seed_sequence, child_seed, numpy_generator, DYNAMICS_STREAM
+
+
+"""Run one large city on several processes: the grid is split into rectangular tiles, every worker
+   process simulates the households of one tile, and the master relays the adoptions on tile borders
+   to the neighboring tiles and merges the tiles' counts into the model reporters."""
+
+
+def tile_bounds(size, parts):
+    """Split range(size) into `parts` nearly equal consecutive ranges, as an array of `parts + 1` bounds."""
+    return np.linspace(0, size, parts + 1).round().astype(int)
+
+
+def rook_moran_terms(shares, x0, y0, width, height):
+    """
+    Moran's I sums (see `IncrementalMoran`) of the inner cells of a tile's padded raster.
+
+    Args:
+        shares (numpy.ndarray): Adopter share of the tile's cells and of the one-cell ring around
+            it, i.e. of the global cells x0 - 1 .. x0 + tile width, y0 - 1 .. y0 + tile height.
+            Cells outside the grid are 0.
+        x0 (int): Global x of the tile's first column.
+        y0 (int): Global y of the tile's first row.
+        width (int): Width of the whole grid.
+        height (int): Height of the whole grid.
+
+    Returns:
+        numpy.ndarray: total, total_sq, cross, col_dot and row_dot of the tile's cells.
+    """
+    padded_width, padded_height = shares.shape
+    gx = np.arange(x0 - 1, x0 - 1 + padded_width)[:, None]
+    gy = np.arange(y0 - 1, y0 - 1 + padded_height)[None, :]
+    inside = (gx >= 0) & (gx < width) & (gy >= 0) & (gy < height)
+    degree = np.where(inside, (gx > 0).astype(int) + (gx < width - 1) + (gy > 0) + (gy < height - 1), 0)
+    inverse_degree = np.divide(1.0, degree, out=np.zeros(degree.shape), where=degree > 0)
+
+    def rook_sum(raster):
+        return raster[:-2, 1:-1] + raster[2:, 1:-1] + raster[1:-1, :-2] + raster[1:-1, 2:]
+
+    y = shares[1:-1, 1:-1]
+    return np.array([
+        y.sum(),
+        (y * y).sum(),
+        (y * inverse_degree[1:-1, 1:-1] * rook_sum(shares)).sum(),  # rows of W are 1 / degree at the rook neighbors
+        (y * rook_sum(inverse_degree)).sum(),  # column sums of W
+        (y * (degree[1:-1, 1:-1] > 0)).sum(),  # row sums of W
+    ])
+
+
+class _Tile:
+    """State of one tile, held by its worker process: its households and the adoption counts of the ring around it."""
+
+    def __init__(self, ids, income, education_level, type, environmental_consciousness, stubborness_factor, x, y,
+                 halo_x, halo_y, halo_type, x0, y0, tile_width, tile_height, width, height, subsidy,
+                 subsidy_timestep, betas, seed):
+        self.ids = ids
+        self.x0, self.y0 = x0, y0
+        self.width, self.height = width, height
+        self.subsidy = subsidy
+        self.subsidy_timestep = subsidy_timestep
+        self.betas = betas
+        self.rng = numpy_generator(seed)
+
+        # Local coordinates in the tile padded with its ring of neighboring cells
+        local_x, local_y = x - x0 + 1, y - y0 + 1
+        self.rasters = CellRasters(np.concatenate([local_x, halo_x - x0 + 1]), np.concatenate([local_y, halo_y - y0 + 1]),
+                                   np.concatenate([type, halo_type]), np.zeros(len(x) + len(halo_x), dtype=np.int8),
+                                   tile_width + 2, tile_height + 2)
+        self.households = HouseholdArrays.from_arrays(income, education_level, type, stubborness_factor,
+                                                      environmental_consciousness, local_x, local_y, self.rasters)
+        # Households whose cell lies in a neighboring tile's ring
+        self.on_border = (local_x == 1) | (local_x == tile_width) | (local_y == 1) | (local_y == tile_height)
+
+    def add_halo_adopters(self, cells):
+        """Register adoptions of neighboring tiles in the ring cells `cells` (global x, y pairs)."""
+        if len(cells):
+            np.add.at(self.rasters.adopters, (cells[:, 0] - self.x0 + 1, cells[:, 1] - self.y0 + 1), 1)
+
+    def step(self, time, halo):
+        """
+        Advance the tile by one step after registering the neighbors' adoptions of the previous step.
+
+        Returns:
+            tuple: Global (x, y) cells of this step's adoptions on the tile border, and the number
+                of adoptions per income level (rows) and dwelling type (columns).
+        """
+        self.add_halo_adopters(halo)
+        households = self.households
+        if time == self.subsidy_timestep and self.subsidy == 1:
+            households.apply_subsidy(self.rng.random(len(households.income)))
+        # The array engine's draws (see `CityModel.step`), from the tile's own stream over its households only
+        noise = self.rng.normal(0, 0.5, size=len(households.income))
+        adopted = households.step(self, *self.betas, noise)
+
+        border = adopted[self.on_border[adopted]]
+        cells = np.column_stack([households.x[border] + self.x0 - 1, households.y[border] + self.y0 - 1])
+        counts = np.zeros((3, 2), dtype=np.int64)
+        np.add.at(counts, (households.income[adopted] - 1, households.type[adopted] - 1), 1)
+        return cells, counts
+
+    def spatial_terms(self, halo, clustering, moran):
+        """Additive clustering and Moran's I terms of the tile's cells, after registering the latest ring adoptions."""
+        self.add_halo_adopters(halo)
+        inner = (slice(1, -1), slice(1, -1))
+        clustering_sums = np.array(clustering_terms(self.rasters, inner), dtype=float) if clustering else None
+        moran_sums = rook_moran_terms(self.rasters.adopter_share(), self.x0, self.y0, self.width, self.height) if moran else None
+        return clustering_sums, moran_sums
+
+
+def _tile_worker(connection, tile_arguments):
+    """Worker process loop: hold one tile and execute the master's commands on it."""
+    tile = _Tile(**tile_arguments)
+    while True:
+        command, payload = connection.recv()
+        if command == "step":
+            connection.send(tile.step(*payload))
+        elif command == "spatial":
+            connection.send(tile.spatial_terms(*payload))
+        elif command == "solar_panels":
+            connection.send((tile.ids, tile.households.solar_panels))
+        elif command == "close":
+            connection.close()
+            return
+
+
+class MoranSums:
+    """Merged Moran's I sums of all tiles, with the `I` property the "Moran's I" reporter reads."""
+
+    def __init__(self, n, s0, sums):
+        self.n = n
+        self.s0 = s0
+        self.sums = sums
+
+    @property
+    def I(self):
+        return morans_I_from_sums(self.n, self.s0, *self.sums.tolist())
+
+
+def tiled_clustering_score(model):
+    """Clustering score merged from the tiles' terms."""
+    fractions, num_adopters = model.clustering_sums
+    return fractions / num_adopters if num_adopters else 0
+
+
+class TiledCity:
+    """
+    A city simulated by several worker processes, one per rectangular tile of the grid.
+
+    Neighbor influence only reaches one Moore ring, so every tile needs the adoption counts of
+    its own cells and of the ring of cells around it. Each step, every worker decides the
+    adoptions of its households from the state at the start of the step (the synchronous update
+    rule of the array engine), and returns the adoptions in its border cells; the master relays
+    those to the tiles whose ring contains them before the next step. Adoption counts, the
+    clustering score and Moran's I are additive over tiles, so the model reporters are merged
+    from per-tile terms without gathering the households.
+
+    The city is the one `CityModel` generates for the same parameters and seed. Every tile draws
+    its subsidies and noise from its own child stream of the dynamics stream, so runs are
+    reproducible for a given seed and tiling; a single tile uses the dynamics stream itself and
+    reproduces the array engine exactly.
+    """
+
+    def __init__(self, width=120, height=120, num_agents=10000, subsidy=1, subsidy_timestep=0, max_steps=200,
+                 beta1=0.35, beta2=0.05, beta3=0.5, beta4=0.2, beta5=0.3, beta6=0.3, beta7=0.6, flag_random=0,
+                 seed=None, tiles=(2, 2), collect_every=1, reporters=None, population=None):
+        """
+        Generate the city and start one worker process per tile.
+
+        Args:
+            width, height, num_agents, subsidy, subsidy_timestep, max_steps, beta1-7, flag_random, seed,
+                collect_every, reporters, population: As for `CityModel`.
+            tiles (tuple): Number of tiles along x and along y.
+        """
+        self.seed = as_seed_sequence(seed)
+        if population is None:
+            population = build_population(width, height, num_agents, flag_random, self.seed)
+        self.width, self.height = width, height
+        self.num_agents = len(population)
+        self.subsidy = subsidy
+        self.max_steps = max_steps
+        self.collect_every = collect_every
+        self.time = 0
+        self.running = True
+
+        self.incomes = {level: {"count": 0, "houses": 0, "apartments": 0} for level in (1, 2, 3)}
+        for level in (1, 2, 3):
+            members = population.income == level
+            self.incomes[level]["count"] = int(members.sum())
+            self.incomes[level]["houses"] = int((members & (population.type == 1)).sum())
+            self.incomes[level]["apartments"] = int((members & (population.type == 2)).sum())
+        self.solar_counts = {level: {"houses": 0, "apartments": 0} for level in (1, 2, 3)}
+        self.total_solar = 0
+
+        model_reporters = {
+            **adoption_count_reporters(),
+            "Global Adoption Rate": compute_global_adoption,
+            "Clustering Score": tiled_clustering_score,
+            "Moran's I": compute_morans_I,
+            "Between-Class Gini": gini_between_income_classes
+        }
+        if reporters is not None:
+            unknown = [name for name in reporters if name not in model_reporters]
+            if unknown:
+                raise ValueError(f"Unknown reporters {unknown}, expected some of {list(model_reporters)}.")
+            model_reporters = {name: model_reporters[name] for name in reporters}
+        self.model_reporters = model_reporters
+        self.model_vars = {name: [] for name in model_reporters}
+        self.collected_steps = []
+        self.clustering_sums = (0.0, 0)
+        self.morans_I = None
+
+        self.x_bounds = tile_bounds(width, tiles[0])
+        self.y_bounds = tile_bounds(height, tiles[1])
+        dynamics = child_seed(self.seed, DYNAMICS_STREAM)
+        self.connections = []
+        self.processes = []
+        num_tiles = tiles[0] * tiles[1]
+        for i in range(tiles[0]):
+            for j in range(tiles[1]):
+                tile_seed = dynamics if num_tiles == 1 else child_seed(dynamics, i * tiles[1] + j)
+                arguments = self._tile_arguments(population, i, j, tile_seed, subsidy_timestep,
+                                                 (beta1, beta2, beta3, beta4, beta5, beta6, beta7))
+                master_end, worker_end = multiprocessing.Pipe()
+                process = multiprocessing.Process(target=_tile_worker, args=(worker_end, arguments), daemon=True)
+                process.start()
+                worker_end.close()
+                self.connections.append(master_end)
+                self.processes.append(process)
+        self.pending_halo = [np.zeros((0, 2), dtype=np.intp) for _ in self.connections]
+
+        if self.should_collect(0):
+            self.collect(0)
+
+    def _tile_arguments(self, population, i, j, seed, subsidy_timestep, betas):
+        """Households, ring and parameters of tile (i, j)."""
+        x0, x1 = self.x_bounds[i], self.x_bounds[i + 1]
+        y0, y1 = self.y_bounds[j], self.y_bounds[j + 1]
+        x, y = population.x, population.y
+        owned = (x >= x0) & (x < x1) & (y >= y0) & (y < y1)
+        ring = (x >= x0 - 1) & (x <= x1) & (y >= y0 - 1) & (y <= y1) & ~owned
+        ids = np.flatnonzero(owned)
+        return {
+            "ids": ids, "income": population.income[ids], "education_level": population.education_level[ids],
+            "type": population.type[ids], "environmental_consciousness": population.environmental_consciousness[ids],
+            "stubborness_factor": population.stubborness_factor[ids], "x": x[ids], "y": y[ids],
+            "halo_x": x[ring], "halo_y": y[ring], "halo_type": population.type[ring],
+            "x0": x0, "y0": y0, "tile_width": x1 - x0, "tile_height": y1 - y0,
+            "width": self.width, "height": self.height, "subsidy": self.subsidy,
+            "subsidy_timestep": subsidy_timestep, "betas": betas, "seed": seed,
+        }
+
+    def _route(self, owner, cells):
+        """Queue the border adoptions `cells` of tile `owner` for every other tile whose ring contains them."""
+        if len(cells) == 0:
+            return
+        ty = len(self.y_bounds) - 1
+        for k in range(len(self.connections)):
+            if k == owner:
+                continue
+            i, j = divmod(k, ty)
+            inside = ((cells[:, 0] >= self.x_bounds[i] - 1) & (cells[:, 0] <= self.x_bounds[i + 1])
+                      & (cells[:, 1] >= self.y_bounds[j] - 1) & (cells[:, 1] <= self.y_bounds[j + 1]))
+            if inside.any():
+                self.pending_halo[k] = np.concatenate([self.pending_halo[k], cells[inside]])
+
+    def _take_halo(self, k):
+        halo, self.pending_halo[k] = self.pending_halo[k], np.zeros((0, 2), dtype=np.intp)
+        return halo
+
+    def step(self):
+        """Advance all tiles by one step and relay their border adoptions."""
+        if self.time >= self.max_steps:
+            self.running = False
+            print("Model has reached max steps, stopping.")
+        for k, connection in enumerate(self.connections):
+            connection.send(("step", (self.time, self._take_halo(k))))
+        for k, connection in enumerate(self.connections):
+            cells, counts = connection.recv()
+            self._route(k, cells)
+            for level in (1, 2, 3):
+                self.solar_counts[level]["houses"] += int(counts[level - 1, 0])
+                self.solar_counts[level]["apartments"] += int(counts[level - 1, 1])
+            self.total_solar += int(counts.sum())
+        self.time += 1
+        if self.should_collect(self.time):
+            self.collect(self.time)
+
+    def should_collect(self, steps_done):
+        """Whether the collection policy asks for the reporters after `steps_done` steps."""
+        if steps_done == self.max_steps:
+            return True
+        return self.collect_every is not None and steps_done % self.collect_every == 0
+
+    def collect(self, steps_done):
+        """Merge the tiles' terms and collect the model reporters for the state after `steps_done` steps."""
+        if self.collected_steps and self.collected_steps[-1] == steps_done:
+            return
+        clustering = "Clustering Score" in self.model_reporters
+        moran = "Moran's I" in self.model_reporters
+        if clustering or moran:
+            for k, connection in enumerate(self.connections):
+                connection.send(("spatial", (self._take_halo(k), clustering, moran)))
+            terms = [connection.recv() for connection in self.connections]
+            if clustering:
+                self.clustering_sums = tuple(np.sum([t[0] for t in terms], axis=0).tolist())
+            if moran:
+                n = self.width * self.height
+                self.morans_I = MoranSums(n, n if n > 1 else 0, np.sum([t[1] for t in terms], axis=0))
+        for name, reporter in self.model_reporters.items():
+            self.model_vars[name].append(reporter(self))
+        self.collected_steps.append(steps_done)
+
+    def get_model_vars_dataframe(self):
+        """The collected model reporters as a DataFrame indexed by the step they were collected after."""
+        return pd.DataFrame(self.model_vars, index=pd.Index(self.collected_steps, name="Step"))
+
+    def solar_panels(self):
+        """Adoption state of every household, gathered from the tiles and indexed like the population."""
+        state = np.zeros(self.num_agents, dtype=np.int8)
+        for connection in self.connections:
+            connection.send(("solar_panels", None))
+            ids, solar_panels = connection.recv()
+            state[ids] = solar_panels
+        return state
+
+    def run_model(self, steps=100):
+        """Run the model for a specified number of steps, collecting the reporters after the last one."""
+        for _ in range(steps):
+            self.step()
+            if not self.running:
+                break
+        self.collect(self.time)
+
+    def close(self):
+        """Stop the worker processes."""
+        for connection, process in zip(self.connections, self.processes):
+            if process.is_alive():
+                connection.send(("close", None))
+            process.join()
+            connection.close()
+        self.connections, self.processes = [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False